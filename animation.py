@@ -0,0 +1,305 @@
+"""Frame-by-frame conversion of animated GIF, WEBP and APNG files
+
+Frames are decoded with ImageSequence, resized and (for GIF output or when
+colors is given) quantized one at a time and handed straight to the
+encoder, so memory depends on the frame size rather than the frame count.
+GIF and APNG are written by the stream writers below, which never keep an
+earlier frame. WEBP goes through Pillow's animation encoder, which only
+holds the frames it has already compressed.
+"""
+import os
+import struct
+import time
+import zlib
+from io import BytesIO
+
+from PIL import Image, ImageSequence
+
+from core import (DEFAULT_EFFORT, get_save_kwargs, guess_format, load_plugins, normalize_format, open_image,
+                  output_size, unlink_shared)
+from metrics import measure
+from streaming import PngStreamWriter
+
+# PNG output is written as APNG
+ANIMATED_OUTPUTS = ['GIF', 'PNG', 'WEBP']
+
+# Palette builder per effort, used when frames are quantized
+QUANTIZE_METHODS = {
+    'fast': Image.Quantize.FASTOCTREE,
+    'balanced': Image.Quantize.MEDIANCUT,
+    'max': Image.Quantize.MEDIANCUT,
+}
+
+
+def is_animated(source):
+    """Check whether source (a path or bytes) has more than one frame"""
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            image = open_image(BytesIO(source))
+        else:
+            image = open_image(source, [guess_format(source)])
+        with image:
+            return getattr(image, 'n_frames', 1) > 1
+    except Exception:
+        return False
+
+
+def quantize_frame(frame, colors=256, method=Image.Quantize.MEDIANCUT):
+    """Reduce an RGBA frame to at most colors palette entries
+
+    Pixels less than half opaque share one extra palette entry, which is
+    marked as the transparent index.
+    """
+    alpha = frame.getchannel('A')
+    if alpha.getextrema()[0] >= 128:
+        return frame.convert('RGB').quantize(colors, method)
+
+    quantized = frame.convert('RGB').quantize(colors - 1, method)
+    palette = quantized.getpalette()
+    transparent = len(palette) // 3
+    quantized.putpalette(palette + [0, 0, 0])
+    quantized.paste(transparent, mask=alpha.point([255] * 128 + [0] * 128))
+    quantized.info['transparency'] = transparent
+    return quantized
+
+
+def iter_frames(image, size, colors=None, method=Image.Quantize.MEDIANCUT, keep_palette=False, metrics=None,
+                timings=None):
+    """Yield (frame, duration in ms) for every frame of image, one at a time
+
+    Frames come out as RGBA at size. With colors they are quantized first,
+    and stay palette images if keep_palette is set. With timings, a dict
+    per frame is appended once the consumer asks for the next one, so its
+    encode time is included.
+    """
+    frames = ImageSequence.Iterator(image)
+    for index in range(getattr(image, 'n_frames', 1)):
+        started = time.perf_counter()
+        with measure(metrics, 'decode_frame') as stage:
+            # Pillow composites each frame onto the canvas while seeking
+            frame = frames[index].convert('RGBA')
+            stage['image'] = frame
+        duration = image.info.get('duration') or 0
+
+        if frame.size != size:
+            with measure(metrics, 'resize_frame') as stage:
+                frame = frame.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                stage['image'] = frame
+        if colors:
+            with measure(metrics, 'quantize_frame') as stage:
+                frame = quantize_frame(frame, colors, method)
+                if not keep_palette:
+                    frame = frame.convert('RGBA')
+                stage['image'] = frame
+
+        processed = time.perf_counter()
+        # The consumer encodes each frame before asking for the next one
+        with measure(metrics, 'encode_frame'):
+            yield frame, duration
+        if timings is not None:
+            timings.append({
+                'index': index,
+                'duration': duration,
+                'process': processed - started,
+                'encode': time.perf_counter() - processed,
+            })
+
+
+def _split_gif(data):
+    """Color table, its size bits, transparent index, interlace flag and image data of a one-frame GIF"""
+    flags = data[10]
+    table_bytes = 3 << ((flags & 7) + 1) if flags & 0x80 else 0
+    table, bits = data[13:13 + table_bytes], flags & 7
+    transparency = None
+
+    position = 13 + table_bytes
+    while data[position] == 0x21:
+        # Extension: label, then data sub-blocks up to an empty one
+        if data[position + 1] == 0xf9 and data[position + 3] & 1:
+            transparency = data[position + 6]
+        position += 2
+        while data[position]:
+            position += data[position] + 1
+        position += 1
+
+    if data[position] != 0x2c:
+        raise ValueError("unexpected block in encoded GIF frame")
+    descriptor_flags = data[position + 9]
+    position += 10
+    if descriptor_flags & 0x80:
+        table_bytes = 3 << ((descriptor_flags & 7) + 1)
+        table, bits = data[position:position + table_bytes], descriptor_flags & 7
+        position += table_bytes
+    # Everything up to the trailer is the LZW-coded image
+    return table, bits, transparency, descriptor_flags & 0x40, data[position:-1]
+
+
+class GifStreamWriter:
+    """Write an animated GIF incrementally, one palette frame at a time
+
+    Pillow LZW-codes each frame as a GIF of its own; its image block is
+    copied here behind a local color table, so frames can have different
+    palettes and none has to be kept.
+    """
+
+    def __init__(self, path, size, loop=None):
+        self.file = open(path, 'wb')
+        self.size = size
+        # No global color table, 8 bits of color resolution
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0x70, 0, 0))
+        if loop is not None:
+            self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def write(self, frame, duration):
+        """Append a palette frame shown for duration milliseconds"""
+        buffer = BytesIO()
+        params = {'optimize': False, 'interlace': False}
+        if 'transparency' in frame.info:
+            params['transparency'] = frame.info['transparency']
+        frame.save(buffer, format='GIF', **params)
+        table, bits, transparency, interlaced, image_data = _split_gif(buffer.getvalue())
+
+        # Frames are whole, so only transparent ones need the canvas cleared after them
+        disposal = 2 if transparency is not None else 1
+        packed = disposal << 2 | (transparency is not None)
+        self.file.write(b'!\xf9\x04' + struct.pack('<BHBB', packed, round(duration / 10), transparency or 0, 0))
+        self.file.write(b',' + struct.pack('<HHHHB', 0, 0, self.size[0], self.size[1], 0x80 | interlaced | bits))
+        self.file.write(table)
+        self.file.write(image_data)
+
+    def close(self):
+        self.file.write(b';')
+        self.file.close()
+
+
+class ApngStreamWriter(PngStreamWriter):
+    """Write an animated PNG incrementally, one RGBA frame at a time
+
+    APNG declares its frame count before the first frame, so it has to be
+    known up front. Every frame is stored whole.
+    """
+
+    def __init__(self, path, size, frame_count, loop=0, compress_level=6):
+        super().__init__(path, size, 'RGBA', compress_level)
+        self.size = size
+        self.compress_level = compress_level
+        self.sequence = 0
+        self.frames = 0
+        self._chunk(b'acTL', struct.pack('>II', frame_count, loop))
+
+    def write(self, frame, duration):
+        """Append an RGBA frame shown for duration milliseconds"""
+        raw = frame.tobytes()
+        rows = b''.join(b'\x00' + raw[i:i + self.row_bytes] for i in range(0, len(raw), self.row_bytes))
+        data = zlib.compress(rows, self.compress_level)
+
+        self._chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, self.size[0], self.size[1], 0, 0,
+                                         round(duration), 1000, 0, 0))
+        self.sequence += 1
+        # The first frame doubles as the still image older viewers show
+        if self.frames == 0:
+            self._chunk(b'IDAT', data)
+        else:
+            self._chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self):
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+
+class _FrameSequence(Image.Image):
+    """Frames from iter_frames presented as one multi-frame image
+
+    Pillow's WEBP save_all seeks through n_frames and encodes each frame as
+    it gets there, so frames are only produced when asked for. Durations
+    are read per frame as the encoder advances, and grow with it.
+    """
+
+    def __init__(self, frames, frame_count):
+        super().__init__()
+        self.frames = frames
+        self.n_frames = frame_count
+        self.durations = []
+        self.position = -1
+        self.seek(0)
+
+    def seek(self, frame):
+        # Pillow seeks back to the start once every frame is encoded, the pixels aren't needed again
+        if frame <= self.position:
+            return
+        if frame != self.position + 1:
+            raise EOFError("frames can only be read in order")
+        image, duration = next(self.frames)
+        if self.position < 0:
+            self.__dict__.update(image.__dict__)
+        else:
+            self.im = image.im
+        self.durations.append(duration)
+        self.position = frame
+
+    def tell(self):
+        return self.position
+
+
+def convert_animation(source, destination, output_format, quality=85, resize=None, maintain_aspect=True,
+                      colors=None, effort=DEFAULT_EFFORT, metrics=None):
+    """Convert an animated image frame by frame, writing straight to destination
+
+    colors quantizes every frame (GIF output always uses at most 256).
+    Returns (success, message, frames) where frames holds the timing of
+    each frame: its duration and the seconds spent decoding, resizing and
+    quantizing it (process) and encoding it (encode).
+    """
+    output_format = normalize_format(output_format)
+    if output_format not in ANIMATED_OUTPUTS:
+        return False, f"{output_format} can't store animations, expected one of {', '.join(ANIMATED_OUTPUTS)}", []
+    if output_format == 'GIF':
+        colors = min(colors or 256, 256)
+
+    # Frames are written while the source is still being read
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return False, "Animation error: destination is the source file", []
+
+    timings = []
+    try:
+        save_kwargs = get_save_kwargs(output_format, quality, effort)
+        unlink_shared(destination)
+        with measure(metrics, 'open'):
+            image = open_image(source, [guess_format(source)])
+        with image:
+            frame_count = getattr(image, 'n_frames', 1)
+            size = output_size(image.size, resize, maintain_aspect)
+            loop = image.info.get('loop')
+            frames = iter_frames(image, size, colors, QUANTIZE_METHODS[effort], output_format == 'GIF', metrics,
+                                 timings)
+
+            if output_format == 'WEBP':
+                # A still source saves as a plain WEBP
+                load_plugins(['WEBP'])
+                sequence = _FrameSequence(frames, frame_count)
+                sequence.save(destination, format='WEBP', save_all=True, duration=sequence.durations,
+                              loop=1 if loop is None else loop, **save_kwargs)
+                # Finish the last frame's timing, which includes assembling the file
+                for _ in frames:
+                    pass
+            else:
+                if output_format == 'GIF':
+                    writer = GifStreamWriter(destination, size, loop)
+                else:
+                    compress_level = 9 if save_kwargs.get('optimize') else save_kwargs.get('compress_level', 6)
+                    writer = ApngStreamWriter(destination, size, frame_count, 1 if loop is None else loop,
+                                              compress_level)
+                try:
+                    for frame, duration in frames:
+                        writer.write(frame, duration)
+                finally:
+                    writer.close()
+    except Exception as e:
+        # Don't leave a truncated animation behind
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False, f"Animation error: {str(e)}", timings
+
+    return True, f"Saved {len(timings)} frames to: {destination}", timings
@@ -0,0 +1,409 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from animation import ANIMATED_OUTPUTS, is_animated
+from cache import ConversionCache
+from converter import ImageConverter
+from core import DEFAULT_EFFORT, guess_format, open_image, output_size
+from metrics import MetricsAggregator
+from streaming import StripReader
+
+# One converter per worker process, created by the pool initializer
+_worker_converter = None
+
+
+def _init_worker(cache_dir=None, cache_bytes=None, collect_metrics=False):
+    """Create the converter used by this worker process"""
+    global _worker_converter
+    cache = None
+    if cache_dir or cache_bytes:
+        cache = ConversionCache(cache_bytes or 64 * 1024 * 1024, cache_dir)
+    _worker_converter = ImageConverter(cache=cache)
+    _worker_converter.collect_metrics = collect_metrics
+
+
+def _needs_streaming(source, max_memory):
+    """Check whether a whole-image conversion of source would exceed max_memory"""
+    try:
+        reader = StripReader(source)
+    except Exception:
+        return False
+    width, height = reader.size
+    # Decoded image, its converted/resized copy and the encoder's working set
+    return reader.bandable and width * height * 4 * 3 > max_memory
+
+
+def _convert_one(source, destination, output_format, quality, resize, maintain_aspect, max_bytes=None,
+                 max_memory=None, effort=None, target_ssim=None):
+    """Run load -> convert -> save for a single file inside a worker"""
+    converter = _worker_converter or ImageConverter()
+    started = time.perf_counter()
+
+    # Stage metrics of every converter call made for this file
+    metrics = []
+    converter.metrics_callback = metrics.append if converter.collect_metrics else None
+
+    # Animations keep every frame when the output can hold them; size and SSIM searches work on stills
+    if (output_format.upper() in ANIMATED_OUTPUTS and not max_bytes and not target_ssim
+            and is_animated(source)):
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        success, message, frames = converter.convert_animation_file(
+            source, destination, output_format, quality, resize, maintain_aspect, effort=effort)
+        return {
+            'source': source,
+            'destination': destination,
+            'success': success,
+            'message': message,
+            'cached': False,
+            'search': None,
+            'frames': len(frames),
+            'seconds': time.perf_counter() - started,
+            'metrics': [call.as_dict() for call in metrics],
+        }
+
+    # Very large uncompressed inputs are converted in bands straight to disk
+    if max_memory and not max_bytes and not target_ssim and _needs_streaming(source, max_memory):
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        success, message = converter.convert_file_streaming(
+            source, destination, output_format, quality, resize, maintain_aspect, max_memory, effort)
+        return {
+            'source': source,
+            'destination': destination,
+            'success': success,
+            'message': message,
+            'cached': False,
+            'search': None,
+            'seconds': time.perf_counter() - started,
+            'metrics': [call.as_dict() for call in metrics],
+        }
+
+    cached = False
+    success, message = converter.load_image(source, target_size=resize, maintain_aspect=maintain_aspect)
+    if success:
+        success, message = converter.convert_image(output_format, quality, resize, maintain_aspect,
+                                                   max_bytes=max_bytes, effort=effort, target_ssim=target_ssim)
+        cached = converter.last_cache_hit
+    if success:
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        # Save with the searched quality so the bytes from the search are reused
+        success, message = converter.save_image(destination, output_format, converter.current_quality, effort)
+
+    # Drop references so the next file doesn't keep this one in memory
+    converter.original_image = None
+    converter.processed_image = None
+    converter.encoded_data = None
+
+    return {
+        'source': source,
+        'destination': destination,
+        'success': success,
+        'message': message,
+        'cached': cached,
+        'search': converter.last_search if max_bytes or target_ssim else None,
+        'seconds': time.perf_counter() - started,
+        'metrics': [call.as_dict() for call in metrics],
+    }
+
+
+def _hash_one(source):
+    """Perceptual hash, dimensions and frame count of a source inside a worker, all None if unreadable"""
+    # numpy is only needed when deduplicating
+    from dedupe import dhash
+
+    try:
+        with open_image(source, [guess_format(source)]) as image:
+            size = image.size
+            frames = getattr(image, 'n_frames', 1)
+            return dhash(image), size, frames
+    except Exception:
+        return None, None, None
+
+
+def find_images(paths, extensions, recursive=True):
+    """Expand files and directories into (source, relative path) pairs"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                walker = os.walk(path)
+            else:
+                walker = [(path, [], os.listdir(path))]
+            for dirpath, dirnames, filenames in walker:
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if os.path.splitext(name)[1].lower() in extensions:
+                        full_path = os.path.join(dirpath, name)
+                        if os.path.isfile(full_path):
+                            found.append((full_path, os.path.relpath(full_path, path)))
+        elif os.path.isfile(path):
+            found.append((path, os.path.basename(path)))
+    return found
+
+
+class BatchConverter:
+    def __init__(self, output_dir, output_format="JPEG", quality=85, resize=None,
+                 maintain_aspect=True, workers=None, max_in_flight=None, suffix="",
+                 cache_dir=None, cache_bytes=None, max_bytes=None, max_memory=None,
+                 collect_metrics=False, effort=DEFAULT_EFFORT, target_ssim=None, dedupe=False,
+                 dedupe_index=None, max_distance=None):
+        self.output_dir = output_dir
+        self.output_format = output_format.upper()
+        self.quality = quality
+        # Encoder effort profile, see core.EFFORT_PROFILES
+        self.effort = effort
+        self.resize = resize
+        self.maintain_aspect = maintain_aspect
+        self.workers = workers or os.cpu_count() or 1
+        # Keep a few tasks queued per worker without submitting the whole tree at once
+        self.max_in_flight = max_in_flight or self.workers * 4
+        self.suffix = suffix
+        # Per-file size budget; quality is then only the starting guess of the search
+        self.max_bytes = max_bytes
+        # Lowest quality reaching this SSIM per file, instead of a fixed quality
+        self.target_ssim = target_ssim
+        # Per-worker memory budget; larger uncompressed TIFF/BMP inputs are streamed
+        self.max_memory = max_memory
+        # Per-worker conversion cache; with cache_dir results persist across runs
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        # Per-stage timings from the workers, summarized after each run
+        self.collect_metrics = collect_metrics
+        self.metrics = MetricsAggregator()
+        # Reuse outputs of perceptual duplicates, tracked in an index file (default: inside output_dir)
+        self.dedupe = dedupe or bool(dedupe_index)
+        self.dedupe_index = dedupe_index
+        self.max_distance = max_distance
+        self.supported_formats = ImageConverter().supported_formats
+
+    def output_path(self, relative_path):
+        """Build the output path for a source, mirroring its relative location"""
+        stem = os.path.splitext(relative_path)[0]
+        return os.path.join(self.output_dir, f"{stem}{self.suffix}.{self.output_format.lower()}")
+
+    def run(self, paths, recursive=True, on_result=None):
+        """Convert every image found under paths and return a summary dict
+        
+        With collect_metrics, summary['stages'] holds wall and CPU time
+        percentiles per converter stage over all files, and self.metrics the
+        aggregator they came from.
+        """
+        sources = find_images(paths, self.supported_formats, recursive)
+        tasks, conflicts = self.split_conflicts([(source, self.output_path(relative)) for source, relative in sources])
+        if self.dedupe:
+            summary = self.convert_deduplicated(tasks, on_result)
+        else:
+            summary = self.convert(tasks, on_result)
+
+        for result in conflicts:
+            summary['total'] += 1
+            summary['failed'] += 1
+            summary['errors'].append((result['source'], result['message']))
+            if on_result:
+                on_result(result)
+        return summary
+
+    @staticmethod
+    def split_conflicts(tasks):
+        """Separate tasks whose destination an earlier task already writes
+
+        Sources differing only in extension (a.jpg and a.png) map to the same
+        output name, and converting both would race on one file. Returns the
+        tasks to convert and a failed result for each one left out.
+        """
+        claimed = {}
+        kept = []
+        conflicts = []
+        for source, destination in tasks:
+            key = os.path.normcase(os.path.abspath(destination))
+            if key in claimed:
+                conflicts.append({'source': source, 'destination': destination, 'success': False,
+                                  'message': f"Output {destination} is already written for {claimed[key]}",
+                                  'cached': False, 'search': None, 'seconds': 0.0, 'metrics': []})
+                continue
+            claimed[key] = source
+            kept.append((source, destination))
+        return kept, conflicts
+
+    def convert(self, tasks, on_result=None):
+        """Convert (source, destination) pairs and return a summary dict like run"""
+        summary = {
+            'total': len(tasks),
+            'succeeded': 0,
+            'failed': 0,
+            'cached': 0,
+            'errors': [],
+            'elapsed': 0.0,
+            'images_per_sec': 0.0,
+        }
+        self.metrics = MetricsAggregator()
+        tasks = iter(tasks)
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.cache_dir, self.cache_bytes, self.collect_metrics)) as pool:
+            pending = {}
+
+            def submit_next():
+                task = next(tasks, None)
+                if task is None:
+                    return False
+                future = pool.submit(_convert_one, task[0], task[1], self.output_format,
+                                     self.quality, self.resize, self.maintain_aspect, self.max_bytes,
+                                     self.max_memory, self.effort, self.target_ssim)
+                pending[future] = task
+                return True
+
+            while len(pending) < self.max_in_flight and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source, destination = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # Worker process died (e.g. killed by the OS) while on this file
+                        result = {'source': source, 'destination': destination, 'success': False,
+                                  'message': f"Worker error: {str(e)}", 'cached': False,
+                                  'search': None, 'seconds': 0.0, 'metrics': []}
+
+                    for call in result['metrics']:
+                        self.metrics.add(call)
+
+                    if result['success']:
+                        summary['succeeded'] += 1
+                        summary['cached'] += result['cached']
+                    else:
+                        summary['failed'] += 1
+                        summary['errors'].append((result['source'], result['message']))
+
+                    if on_result:
+                        on_result(result)
+
+                while len(pending) < self.max_in_flight and submit_next():
+                    pass
+
+        summary['elapsed'] = time.perf_counter() - started
+        if summary['elapsed'] > 0:
+            summary['images_per_sec'] = summary['succeeded'] / summary['elapsed']
+        if self.collect_metrics:
+            summary['stages'] = self.metrics.summary()
+        return summary
+
+    def convert_deduplicated(self, tasks, on_result=None):
+        """Convert (source, destination) pairs, linking outputs for perceptual duplicates
+
+        First every source is hashed on a reduced decode in the worker pool.
+        Sources within max_distance bits of an indexed output, or of an
+        earlier source in this run, get that output hard linked (or copied)
+        to their destination; only the rest are converted. The summary is
+        like run's plus 'duplicates' and 'hash_seconds'.
+        """
+        from dedupe import DEFAULT_MAX_DISTANCE, INDEX_NAME, DuplicateIndex, link_output
+
+        started = time.perf_counter()
+        tasks = list(tasks)
+        index = DuplicateIndex(self.dedupe_index or os.path.join(self.output_dir, INDEX_NAME),
+                               DEFAULT_MAX_DISTANCE if self.max_distance is None else self.max_distance)
+        settings = {
+            'format': self.output_format,
+            'quality': self.quality,
+            'resize': list(self.resize) if self.resize else None,
+            'maintain_aspect': self.maintain_aspect,
+            'max_bytes': self.max_bytes,
+            'target_ssim': self.target_ssim,
+            'effort': self.effort,
+        }
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            chunksize = max(1, len(tasks) // (self.workers * 4))
+            hashes = list(pool.map(_hash_one, [source for source, _ in tasks], chunksize=chunksize))
+        hash_seconds = time.perf_counter() - started
+
+        unique = []
+        duplicates = []
+        for (source, destination), (value, size, frames) in zip(tasks, hashes):
+            if value is None:
+                # Unreadable, the conversion reports why
+                unique.append((source, destination))
+                continue
+            key = index.group_key(settings, output_size(size, self.resize, self.maintain_aspect), frames)
+            existing = index.find(value, key)
+            if existing:
+                duplicates.append((source, destination, existing, value, key))
+                continue
+            # Later sources of this run can match it while it converts
+            index.add(value, key, source, destination, pending=True)
+            unique.append((source, destination))
+
+        def record(result):
+            if result['success']:
+                index.release(result['destination'])
+            else:
+                index.remove(result['destination'])
+            if on_result:
+                on_result(result)
+
+        retry = {}
+
+        def record_retry(result):
+            if result['success']:
+                value, key = retry[result['source']]
+                index.add(value, key, result['source'], result['destination'])
+            if on_result:
+                on_result(result)
+
+        try:
+            summary = self.convert(unique, record)
+            summary['duplicates'] = 0
+
+            retry_tasks = []
+            for source, destination, existing, value, key in duplicates:
+                # The source it duplicates failed to convert
+                if not os.path.exists(existing):
+                    retry[source] = (value, key)
+                    retry_tasks.append((source, destination))
+                    continue
+                linked = time.perf_counter()
+                try:
+                    how = link_output(existing, destination)
+                    if how == "kept":
+                        message = "Output already up to date"
+                    else:
+                        message = f"Duplicate of {existing} ({how})"
+                    result = {'success': True, 'message': message}
+                except OSError as e:
+                    result = {'success': False, 'message': f"Link error: {str(e)}"}
+                result.update({'source': source, 'destination': destination, 'cached': False, 'search': None,
+                               'duplicate_of': existing, 'seconds': time.perf_counter() - linked, 'metrics': []})
+
+                summary['total'] += 1
+                if result['success']:
+                    summary['succeeded'] += 1
+                    summary['duplicates'] += 1
+                else:
+                    summary['failed'] += 1
+                    summary['errors'].append((source, result['message']))
+                if on_result:
+                    on_result(result)
+
+            if retry_tasks:
+                metrics = self.metrics
+                retried = self.convert(retry_tasks, record_retry)
+                for name, records in self.metrics.samples.items():
+                    metrics.samples.setdefault(name, []).extend(records)
+                self.metrics = metrics
+                for field in ['total', 'succeeded', 'failed', 'cached', 'errors']:
+                    summary[field] += retried[field]
+        finally:
+            index.save()
+
+        summary['hash_seconds'] = hash_seconds
+        summary['elapsed'] = time.perf_counter() - started
+        if summary['elapsed'] > 0:
+            summary['images_per_sec'] = summary['succeeded'] / summary['elapsed']
+        if self.collect_metrics:
+            summary['stages'] = self.metrics.summary()
+        return summary
@@ -0,0 +1,393 @@
+"""Benchmarks for the ImageConverter hot paths
+
+Generates synthetic inputs, times load_image, convert_image, save_image,
+get_preview_images and estimate_file_size per output format and quality,
+and records peak memory. Results are written as JSON so two runs can be
+compared:
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json
+    python benchmark.py --compare before.json after.json
+
+--startup instead measures how long fresh interpreters take to import the
+converter and finish a first conversion, and exits non-zero when a budget
+is exceeded or the command line path pulls in the GUI.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import PIL
+from PIL import Image, ImageDraw
+
+from converter import ImageConverter
+from core import DEFAULT_EFFORT, EFFORTS
+
+SIZES = {
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (4000, 3000),
+}
+MODES = ['RGB', 'RGBA', 'P']
+INPUT_FORMATS = ['JPEG', 'PNG', 'WEBP', 'BMP']
+OUTPUT_FORMATS = ['JPEG', 'PNG', 'WEBP', 'BMP']
+QUALITIES = [50, 85]
+STAGES = ['load_image', 'convert_image', 'get_preview_images', 'estimate_file_size', 'save_image']
+
+# Milliseconds each startup check may take beyond a bare interpreter
+STARTUP_BUDGETS = {
+    'import_core': 100,
+    'import_converter': 130,
+    'cli_help': 160,
+    'first_conversion': 250,
+}
+# Modules scripted and worker use must never import
+GUI_MODULES = ['customtkinter', 'tkinter', 'gui', 'numpy']
+
+# Modes each input format can store
+FORMAT_MODES = {
+    'JPEG': ['RGB'],
+    'PNG': ['RGB', 'RGBA', 'P'],
+    'WEBP': ['RGB', 'RGBA'],
+    'BMP': ['RGB', 'P'],
+}
+
+
+def make_image(size, mode, seed=0):
+    """Build a deterministic photo-like test image: gradients, shapes and noise"""
+    width, height = size
+    base = Image.merge('RGB', [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+    ])
+
+    draw = ImageDraw.Draw(base)
+    for i in range(24):
+        x = (seed * 7919 + i * 104729) % width
+        y = (seed * 6271 + i * 15485863) % height
+        r = max(4, min(size) // (6 + i % 5))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=((i * 53) % 256, (i * 97) % 256, (i * 151) % 256))
+
+    # Sensor-like noise keeps the encoders from seeing unrealistically flat areas
+    noise = Image.effect_noise(size, 24).convert('RGB')
+    image = Image.blend(base, noise, 0.15)
+
+    if mode == 'RGBA':
+        image.putalpha(Image.radial_gradient('L').resize(size))
+    elif mode == 'P':
+        image = image.quantize(256)
+    return image
+
+
+def generate_inputs(directory, sizes, modes, formats):
+    """Write synthetic inputs and return their descriptions"""
+    inputs = []
+    for size_name in sizes:
+        for mode in modes:
+            image = None
+            for input_format in formats:
+                if mode not in FORMAT_MODES[input_format]:
+                    continue
+                if image is None:
+                    image = make_image(SIZES[size_name], mode)
+                path = os.path.join(directory, f"{size_name}_{mode}.{input_format.lower()}")
+                image.save(path, format=input_format)
+                inputs.append({
+                    'path': path,
+                    'size_name': size_name,
+                    'size': SIZES[size_name],
+                    'mode': mode,
+                    'format': input_format,
+                    'file_bytes': os.path.getsize(path),
+                })
+    return inputs
+
+
+def _peak_rss_kb():
+    """Peak resident set size of this process in KB"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _time_stage(timings, stage, func):
+    started = time.perf_counter()
+    result = func()
+    timings[stage].append(time.perf_counter() - started)
+    return result
+
+
+def run_case(case):
+    """Time every stage of one input/format/quality combination
+
+    Runs in a fresh worker process so the peak RSS belongs to this case.
+    """
+    repeats = case['repeats']
+    timings = {stage: [] for stage in STAGES}
+    output_path = os.path.join(case['output_dir'], f"out.{case['output_format'].lower()}")
+    output_bytes = None
+    error = None
+
+    tracemalloc.start()
+    for _ in range(case['warmup'] + repeats):
+        converter = ImageConverter()
+
+        def load():
+            result = converter.load_image(case['path'])
+            # Image.open is lazy, so force the decode inside the load stage
+            if result[0]:
+                converter.original_image.load()
+            return result
+
+        success, message = _time_stage(timings, 'load_image', load)
+        if not success:
+            error = message
+            break
+
+        success, message = _time_stage(timings, 'convert_image', lambda: converter.convert_image(
+            case['output_format'], case['quality'], effort=case['effort']))
+        if not success:
+            error = message
+            break
+
+        _time_stage(timings, 'get_preview_images', converter.get_preview_images)
+        _time_stage(timings, 'estimate_file_size', lambda: converter.estimate_file_size(
+            case['output_format'], case['quality'], case['effort']))
+        success, message = _time_stage(timings, 'save_image', lambda: converter.save_image(
+            output_path, case['output_format'], case['quality'], case['effort']))
+        if not success:
+            error = message
+            break
+        output_bytes = os.path.getsize(output_path)
+
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = {}
+    for stage, values in timings.items():
+        # Warm-up rounds absorb one-off costs like plugin imports
+        values = values[case['warmup']:]
+        if values:
+            stages[stage] = {
+                'min': min(values),
+                'median': statistics.median(values),
+                'max': max(values),
+            }
+
+    case_id = f"{case['input_id']}->{case['output_format']}@q{case['quality']}"
+    # Ids of default-effort cases stay comparable with results from before efforts existed
+    if case['effort'] != DEFAULT_EFFORT:
+        case_id += f"/{case['effort']}"
+
+    return {
+        'id': case_id,
+        'input': case['input_id'],
+        'output_format': case['output_format'],
+        'quality': case['quality'],
+        'effort': case['effort'],
+        'repeats': repeats,
+        'stages': stages,
+        'total_median': sum(stage['median'] for stage in stages.values()),
+        'output_bytes': output_bytes,
+        'peak_rss_kb': _peak_rss_kb(),
+        'python_peak_bytes': python_peak,
+        'error': error,
+    }
+
+
+def run_benchmarks(sizes, modes, input_formats, output_formats, qualities, repeats, warmup=1, progress=None,
+                   efforts=(DEFAULT_EFFORT,)):
+    """Generate inputs, run every case and return the results document"""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = generate_inputs(directory, sizes, modes, input_formats)
+
+        cases = []
+        for item in inputs:
+            input_id = f"{item['size_name']}_{item['mode']}.{item['format'].lower()}"
+            for output_format in output_formats:
+                # Quality only matters for lossy outputs
+                for quality in qualities if output_format in ['JPEG', 'WEBP'] else qualities[-1:]:
+                    for effort in efforts:
+                        cases.append({
+                            'path': item['path'],
+                            'input_id': input_id,
+                            'output_format': output_format,
+                            'quality': quality,
+                            'effort': effort,
+                            'repeats': repeats,
+                            'warmup': warmup,
+                            'output_dir': directory,
+                        })
+
+        # A fresh process per case keeps peak memory figures independent
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            for result in pool.imap(run_case, cases):
+                results.append(result)
+                if progress:
+                    progress(result)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeats': repeats,
+            'warmup': warmup,
+        },
+        'inputs': [{key: value for key, value in item.items() if key != 'path'} for item in inputs],
+        'results': results,
+    }
+
+
+def _time_command(args, repeats):
+    """Median wall time of running args in a fresh process, in ms"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run(args, cwd=directory, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run_startup(repeats=5):
+    """Time imports and a first conversion in fresh interpreters, returning the number of failures"""
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "startup.jpg")
+        make_image(SIZES['small'], 'RGB').save(path, format='JPEG')
+        conversion = f"from core import ConversionJob, run_job; assert run_job(ConversionJob({path!r}, 'WEBP')).success"
+        checks = {
+            'import_core': [sys.executable, "-c", "import core"],
+            'import_converter': [sys.executable, "-c", "import converter"],
+            'cli_help': [sys.executable, "main.py", "--help"],
+            'first_conversion': [sys.executable, "-c", conversion],
+        }
+
+        baseline = _time_command([sys.executable, "-c", "pass"], repeats)
+        print(f"{'interpreter':<20} {baseline:>8.1f}ms")
+        for name, args in checks.items():
+            overhead = _time_command(args, repeats) - baseline
+            flag = ""
+            if overhead > STARTUP_BUDGETS[name]:
+                flag = "  OVER BUDGET"
+                failures += 1
+            print(f"{name:<20} {overhead:>+8.1f}ms (budget {STARTUP_BUDGETS[name]}ms){flag}")
+
+        # Which modules the scripted paths end up importing
+        probe = (f"import json, sys; import batch, converter, server, watch; {conversion}; "
+                 "print(json.dumps(sorted(sys.modules)))")
+        output = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True, capture_output=True, text=True).stdout
+        modules = json.loads(output)
+
+    gui = [module for module in GUI_MODULES if module in modules]
+    plugins = [module[4:] for module in modules if module.startswith("PIL.") and module.endswith("ImagePlugin")]
+    print(f"{'plugins loaded':<20} {', '.join(plugins)}")
+    if gui:
+        print(f"{'gui modules':<20} {', '.join(gui)}  SHOULD NOT BE IMPORTED")
+        failures += 1
+    return failures
+
+
+def compare(baseline_path, current_path, threshold=0.10):
+    """Print per-stage changes between two result files, returning the number of regressions"""
+    with open(baseline_path) as f:
+        baseline = {result['id']: result for result in json.load(f)['results']}
+    with open(current_path) as f:
+        current = {result['id']: result for result in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'case':<40} {'stage':<20} {'before':>10} {'after':>10} {'change':>8}")
+    for case_id in sorted(set(baseline) & set(current)):
+        for stage in STAGES + ['total']:
+            if stage == 'total':
+                before = baseline[case_id]['total_median']
+                after = current[case_id]['total_median']
+            else:
+                if stage not in baseline[case_id]['stages'] or stage not in current[case_id]['stages']:
+                    continue
+                before = baseline[case_id]['stages'][stage]['median']
+                after = current[case_id]['stages'][stage]['median']
+
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{case_id:<40} {stage:<20} {before * 1000:>8.1f}ms {after * 1000:>8.1f}ms "
+                  f"{change:>+7.0%}{flag}")
+
+        before_rss = baseline[case_id].get('peak_rss_kb')
+        after_rss = current[case_id].get('peak_rss_kb')
+        if before_rss and after_rss:
+            print(f"{case_id:<40} {'peak_rss':<20} {before_rss / 1024:>8.1f}MB {after_rss / 1024:>8.1f}MB "
+                  f"{(after_rss - before_rss) / before_rss:>+7.0%}")
+
+    missing = set(baseline) ^ set(current)
+    if missing:
+        print(f"{len(missing)} cases only present in one of the files")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ImageConverter hot paths")
+    parser.add_argument("-o", "--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--sizes", nargs="+", default=['small', 'medium'], choices=list(SIZES))
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--input-formats", nargs="+", default=INPUT_FORMATS, type=str.upper, choices=INPUT_FORMATS)
+    parser.add_argument("--output-formats", nargs="+", default=OUTPUT_FORMATS, type=str.upper, choices=OUTPUT_FORMATS)
+    parser.add_argument("--qualities", nargs="+", type=int, default=QUALITIES)
+    parser.add_argument("--efforts", nargs="+", default=[DEFAULT_EFFORT], choices=EFFORTS,
+                        help="Encoder effort profiles to measure (default: max)")
+    parser.add_argument("-n", "--repeats", type=int, default=3, help="Timed repetitions per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed repetitions before measuring")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default: 0.10)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Check import and first conversion times against their budgets instead")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        return 1 if run_startup(max(args.repeats, 5)) else 0
+
+    if args.compare:
+        return 1 if compare(*args.compare, threshold=args.threshold) else 0
+
+    def progress(result):
+        status = result['error'] or f"{result['total_median'] * 1000:.1f}ms"
+        print(f"{result['id']:<40} {status}", file=sys.stderr)
+
+    document = run_benchmarks(args.sizes, args.modes, args.input_formats, args.output_formats,
+                              args.qualities, args.repeats, args.warmup, progress, args.efforts)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
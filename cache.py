@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class ConversionCache:
+    """LRU cache of encoded conversion results, bounded by a byte budget
+
+    Keys combine the source identity with the conversion settings. Entries
+    hold the encoded bytes and optionally a small preview image. With a
+    cache_dir, encoded bytes are also written to disk so later runs (or
+    other processes) over unchanged inputs can reuse them.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def source_key(file_path, content_hash=False):
+        """Identify a source file by path and mtime, or by a hash of its contents"""
+        if content_hash:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            return ('sha256', digest.hexdigest())
+
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def make_key(source_key, output_format, quality, resize=None, maintain_aspect=True, effort='max',
+                 preview=False):
+        """Build the cache key for one conversion of a source"""
+        if resize is not None:
+            resize = tuple(resize)
+        return (source_key, output_format, quality, resize, maintain_aspect, effort, preview)
+
+    def _entry_size(self, entry):
+        size = len(entry['data'])
+        if entry['preview'] is not None:
+            size += entry['preview'].width * entry['preview'].height * len(entry['preview'].getbands())
+        return size
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name + '.bin')
+
+    def get(self, key):
+        """Return the cached entry dict (data, preview) or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        # Previews are only kept in memory, encoded bytes can come from disk
+        if self.cache_dir and not key[-1]:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                entry = self.put(key, data, persist=False)
+                with self.lock:
+                    self.hits += 1
+                return entry
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data, preview=None, persist=True):
+        """Store encoded bytes (and an optional preview) under key, returning the entry"""
+        entry = {'data': data, 'preview': preview}
+        size = self._entry_size(entry)
+
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self._entry_size(self.entries.pop(key))
+
+            # Entries bigger than the whole budget would just flush everything else
+            if size <= self.max_bytes:
+                self.entries[key] = entry
+                self.current_bytes += size
+                self._evict()
+
+        if persist and self.cache_dir and not key[-1]:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except OSError:
+                pass
+        return entry
+
+    def set_preview(self, key, preview):
+        """Attach a preview image to an existing entry"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['preview'] is not None:
+                return
+            self.current_bytes -= self._entry_size(entry)
+            entry['preview'] = preview
+            self.current_bytes += self._entry_size(entry)
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until within budget"""
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.current_bytes -= self._entry_size(entry)
+
+    def clear(self):
+        """Drop all in-memory entries"""
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Get hit/miss counters and memory usage"""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
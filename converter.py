@@ -1,20 +1,177 @@
 from PIL import Image
+import functools
 import os
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from core import (ConversionJob, DEFAULT_EFFORT, LOSSY_FORMATS, PREVIEW_EFFORT, convert_loaded, encode,
+                  get_save_kwargs, guess_format, load_plugins, normalize_format, open_image, output_size,
+                  resize_image, search_quality, unlink_shared)
+from metrics import ConversionMetrics, measure
+from animation import convert_animation
+from streaming import stream_convert
+
+# Largest side of the cached proxy used for interactive previews
+PREVIEW_PROXY_SIZE = (600, 600)
+# Size of the before/after thumbnails shown by the GUI
+PREVIEW_THUMBNAIL_SIZE = (300, 300)
+
+def _instrumented(method):
+    """Collect stage metrics for each call of a public method while enabled"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # Calls made from inside another instrumented call add to its metrics
+        if not self.collect_metrics or self._metrics is not None:
+            return method(self, *args, **kwargs)
+        
+        self._metrics = ConversionMetrics(method.__name__)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics, self._metrics = self._metrics, None
+            self.last_metrics = metrics
+            if self.metrics_callback:
+                self.metrics_callback(metrics)
+    return wrapper
 
 class ImageConverter:
-    def __init__(self):
-        self.supported_formats = ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff']
+    """Single-image facade over core for the GUI
+    
+    Holds the loaded image, the last conversion and its previews so the GUI
+    can convert, preview and save step by step. Not thread-safe; code that
+    converts many images concurrently should use core.run_job or
+    core.AsyncConverter instead.
+    """
+    
+    def __init__(self, cache=None, metrics_callback=None):
+        self.supported_formats = ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.gif']
         self.original_image = None
+        # Dimensions of the file on disk, original_image may be decoded smaller
+        self.source_size = None
         self.processed_image = None
         self.current_quality = 85
         self.current_format = "JPEG"
+        self.current_resize = None
+        self.current_maintain_aspect = True
+        # Encoder effort profile for full conversions when none is passed, see core.EFFORT_PROFILES
+        self.effort = DEFAULT_EFFORT
+        self.current_effort = DEFAULT_EFFORT
+        # Encoded bytes of processed_image, produced with current_format/current_quality/current_effort
+        self.encoded_data = None
+        # Screen-sized copy of original_image and the last preview conversion of it
+        self.preview_proxy = None
+        self.preview_image = None
+        self.preview_settings = None
+        self.preview_encoded_size = 0
+        # Thumbnail of the original for get_preview_images, as (max_size, image)
+        self.original_thumbnail = None
+        # Optional ConversionCache shared with other converters
+        self.cache = cache
+        self.source_key = None
+        self.current_cache_key = None
+        self.last_cache_hit = False
+        self.processed_thumbnail = None
+        # Outcome of the last max_bytes or target_ssim quality search
+        self.last_search = None
+        # Per-stage timings: metrics_callback gets a ConversionMetrics after every
+        # instrumented call, collect_metrics can also be switched on without one
+        self.metrics_callback = metrics_callback
+        self.collect_metrics = metrics_callback is not None
+        self.last_metrics = None
+        self._metrics = None
+        
+    def _stage(self, name):
+        """Measure a block as one stage of the current call, if metrics are on"""
+        return measure(self._metrics, name)
+    
+    def _normalize_format(self, output_format):
+        """Map format aliases to the name Pillow expects"""
+        return normalize_format(output_format)
+    
+    def _get_save_kwargs(self, output_format, quality, effort=None):
+        """Encoder settings shared by convert, save and size estimation"""
+        return get_save_kwargs(output_format, quality, effort or self.effort)
+    
+    def _has_encoded(self, output_format, quality, effort=None):
+        """Check whether encoded_data matches the requested settings"""
+        if (self.encoded_data is None or output_format != self.current_format
+                or (effort or self.effort) != self.current_effort):
+            return False
+        # Quality only affects lossy formats
+        return output_format not in LOSSY_FORMATS or quality == self.current_quality
+    
+    def _resize_image(self, image, resize, maintain_aspect):
+        """Resize a copy of image, returning image itself when nothing changes"""
+        return resize_image(image, resize, maintain_aspect)
+    
+    def _output_size(self, size, resize, maintain_aspect):
+        """Compute the size _resize_image would produce without touching pixels"""
+        return output_size(size, resize, maintain_aspect)
+    
+    def _encode(self, image, output_format, quality, effort=None):
+        """Encode image with the shared settings and return the bytes"""
+        return encode(image, output_format, quality, self._metrics, effort or self.effort)
+    
+    def get_preview_proxy(self):
+        """Get the cached screen-sized copy of the original image"""
+        if not self.original_image:
+            return None
+        if self.preview_proxy is None:
+            self.preview_proxy = self._open_reduced(PREVIEW_PROXY_SIZE)
+        return self.preview_proxy
+    
+    def _open_reduced(self, max_size):
+        """Decode a copy of the original no larger than max_size
+        
+        Opening the file again lets thumbnail() use JPEG DCT scaling (draft)
+        and reduce() instead of decoding and copying the full image.
+        """
+        if self.original_image.filename and self.original_image.tile:
+            try:
+                with open_image(self.original_image.filename, [self.original_image.format]) as image:
+                    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+                    return image.copy()
+            except OSError:
+                pass
         
-    def load_image(self, file_path):
-        """Load image and verify format"""
+        # Already decoded (or not backed by a file), so shrink the pixels we have
+        image = self.original_image.copy()
+        image.thumbnail(max_size, Image.Resampling.LANCZOS)
+        return image
+        
+    @_instrumented
+    def load_image(self, file_path, target_size=None, maintain_aspect=True):
+        """Load image and verify format
+        
+        target_size is the resize box the output will be fitted to, as passed
+        to convert_image along with maintain_aspect. When given, JPEG files
+        are decoded at the smallest DCT scale that still covers the fitted
+        size, so original_image may be smaller than source_size.
+        """
         try:
-            self.original_image = Image.open(file_path)
-            self.original_image.filename = file_path  # Store original filename
+            # Image.open only reads the header, pixels are decoded on first use
+            with self._stage('open'):
+                self.original_image = open_image(file_path, [guess_format(file_path)])
+                self.original_image.filename = file_path  # Store original filename
+                self.source_size = self.original_image.size
+                
+                if target_size:
+                    fitted = self._output_size(self.source_size, target_size, maintain_aspect)
+                    self.original_image.draft(self.original_image.mode, fitted)
+                
+                # Identify the source for cache lookups, along with the size it was decoded at
+                self.source_key = None
+                if self.cache:
+                    self.source_key = self.cache.source_key(file_path) + (self.original_image.size,)
+            
+            # Results from the previous image are no longer valid
+            self.processed_image = None
+            self.encoded_data = None
+            self.preview_proxy = None
+            self.preview_image = None
+            self.preview_settings = None
+            self.original_thumbnail = None
+            self.current_cache_key = None
+            self.processed_thumbnail = None
             return True, "Image loaded successfully"
         except Exception as e:
             return False, f"Error loading image: {str(e)}"
@@ -28,7 +185,7 @@ class ImageConverter:
             file_size = os.path.getsize(self.original_image.filename) if self.original_image.filename else 0
             info = {
                 'format': self.original_image.format,
-                'size': self.original_image.size,
+                'size': self.source_size,
                 'mode': self.original_image.mode,
                 'file_size': f"{file_size / 1024:.1f} KB",
                 'filename': os.path.basename(self.original_image.filename) if self.original_image.filename else "Unknown"
@@ -37,58 +194,190 @@ class ImageConverter:
         except:
             return None
     
-    def convert_image(self, output_format, quality=85, resize=None, maintain_aspect=True):
-        """Convert image to desired format with quality applied to preview"""
+    def _cache_key(self, output_format, quality, resize, maintain_aspect, effort, preview=False):
+        """Cache key for the loaded source, or None when caching is off"""
+        if not self.cache or self.source_key is None:
+            return None
+        return self.cache.make_key(self.source_key, output_format, quality, resize, maintain_aspect, effort,
+                                   preview)
+    
+    def _search_quality(self, image, output_format, max_bytes, start_quality=85, max_iterations=8, effort=None):
+        """Find the highest quality whose encode fits in max_bytes, see core.search_quality"""
+        return search_quality(image, output_format, max_bytes, start_quality, max_iterations, self._metrics,
+                              effort or self.effort)
+    
+    def _resize_stage(self, image, resize, maintain_aspect):
+        """_resize_image timed as the resize stage"""
+        with self._stage('resize') as stage:
+            resized = self._resize_image(image, resize, maintain_aspect)
+            stage['image'] = resized
+        return resized
+    
+    @_instrumented
+    def convert_image(self, output_format, quality=85, resize=None, maintain_aspect=True, preview=False,
+                      max_bytes=None, effort=None, target_ssim=None):
+        """Convert image to desired format with quality applied to preview
+        
+        With preview=True only the screen-sized proxy is resized and encoded,
+        filling preview_image instead of processed_image. Previews use the
+        fast effort profile and full conversions self.effort, unless effort
+        is given.
+        
+        With max_bytes the quality argument is only the starting guess: the
+        highest quality whose output fits is searched for, and stored in
+        current_quality. last_search records the quality, size and encode
+        iterations used.
+        
+        With target_ssim the quality argument is ignored and the lowest
+        quality whose output reaches that SSIM against the (resized) source
+        is used instead; last_search also records the SSIM reached.
+        """
         if not self.original_image:
             return False, "No image loaded"
         
+        if preview:
+            return self._convert_preview(output_format, quality, resize, maintain_aspect,
+                                         effort or PREVIEW_EFFORT)
+        
+        effort = effort or self.effort
+        if max_bytes or target_ssim:
+            return self._convert_searched(output_format, quality, resize, maintain_aspect, effort,
+                                          max_bytes, target_ssim)
+        
         try:
+            output_format = self._normalize_format(output_format)
+            
             # Store current settings
             self.current_quality = quality
             self.current_format = output_format
+            self.current_resize = resize
+            self.current_maintain_aspect = maintain_aspect
+            self.current_effort = effort
+            self.encoded_data = None
+            self.processed_thumbnail = None
             
-            # Create copy of original image
-            converted = self.original_image.copy()
+            # Reuse an earlier conversion with the same source and settings
+            self.current_cache_key = self._cache_key(output_format, quality, resize, maintain_aspect, effort)
+            entry = None
+            if self.current_cache_key:
+                with self._stage('cache_lookup'):
+                    entry = self.cache.get(self.current_cache_key)
+            self.last_cache_hit = entry is not None
             
-            # Resize if needed
-            if resize and resize != converted.size:
-                if maintain_aspect:
-                    # Maintain aspect ratio
-                    converted.thumbnail(resize, Image.Resampling.LANCZOS)
-                else:
-                    # Force exact size
-                    converted = converted.resize(resize, Image.Resampling.LANCZOS)
+            if entry:
+                self.encoded_data = entry['data']
+                self.processed_thumbnail = entry['preview']
+            else:
+                # Apply quality settings for preview by saving to buffer and reloading
+                # This ensures the preview reflects the actual quality compression
+                # Keep the encoded bytes so save and size estimation don't encode again
+                job = ConversionJob(self.original_image.filename, output_format, quality, resize, maintain_aspect,
+                                    effort=effort)
+                self.encoded_data = convert_loaded(self.original_image, job, self._metrics).data
+                
+                if self.current_cache_key:
+                    with self._stage('cache_store'):
+                        self.cache.put(self.current_cache_key, self.encoded_data)
             
-            # Handle format-specific conversions
-            if output_format.upper() in ['JPEG', 'JPG']:
-                if converted.mode in ['RGBA', 'P']:
-                    converted = converted.convert('RGB')
+            self._set_processed()
             
-            # Apply quality settings for preview by saving to buffer and reloading
-            # This ensures the preview reflects the actual quality compression
-            buffer = BytesIO()
-            save_kwargs = {}
+            return True, f"Conversion to {output_format} successful"
             
-            if output_format.upper() in ['JPEG', 'JPG']:
-                save_kwargs = {'quality': quality, 'optimize': True}
-            elif output_format.upper() == 'WEBP':
-                save_kwargs = {'quality': quality, 'method': 6}
-            elif output_format.upper() == 'PNG':
-                save_kwargs = {'optimize': True}
+        except Exception as e:
+            return False, f"Conversion error: {str(e)}"
+    
+    def _set_processed(self):
+        """Decode encoded_data into processed_image"""
+        # Reload from buffer to get the compressed version
+        self.processed_image = open_image(BytesIO(self.encoded_data), [self.current_format])
+        
+        # The full-resolution result supersedes any proxy preview
+        self.preview_image = None
+        self.preview_settings = None
+    
+    def _convert_searched(self, output_format, quality, resize, maintain_aspect, effort, max_bytes, target_ssim):
+        """Run a full conversion searching for the quality that fits max_bytes or reaches target_ssim"""
+        try:
+            output_format = self._normalize_format(output_format)
             
-            # Save with quality settings to buffer
-            converted.save(buffer, format=output_format.upper(), **save_kwargs)
+            self.current_format = output_format
+            self.current_resize = resize
+            self.current_maintain_aspect = maintain_aspect
+            self.current_effort = effort
+            self.encoded_data = None
+            self.processed_thumbnail = None
+            self.last_cache_hit = False
             
-            # Reload from buffer to get the compressed version
-            buffer.seek(0)
-            self.processed_image = Image.open(buffer)
+            job = ConversionJob(self.original_image.filename, output_format, quality, resize, maintain_aspect,
+                                max_bytes, effort, target_ssim)
+            result = convert_loaded(self.original_image, job, self._metrics)
+            self.encoded_data = result.data
+            quality = self.current_quality = result.quality
+            self.last_search = result.search
             
-            return True, f"Conversion to {output_format} successful"
+            # Plain conversions at the found quality can reuse the result
+            self.current_cache_key = self._cache_key(output_format, quality, resize, maintain_aspect, effort)
+            if self.current_cache_key:
+                with self._stage('cache_store'):
+                    self.cache.put(self.current_cache_key, self.encoded_data)
+            
+            self._set_processed()
+            
+            return True, result.message
+            
+        except Exception as e:
+            return False, f"Conversion error: {str(e)}"
+    
+    def _convert_preview(self, output_format, quality, resize, maintain_aspect, effort):
+        """Run the conversion on the preview proxy"""
+        try:
+            output_format = self._normalize_format(output_format)
+            
+            cache_key = self._cache_key(output_format, quality, resize, maintain_aspect, effort, preview=True)
+            entry = None
+            if cache_key:
+                with self._stage('cache_lookup'):
+                    entry = self.cache.get(cache_key)
+            
+            if entry:
+                self.preview_image = entry['preview']
+                self.preview_encoded_size = len(entry['data'])
+            else:
+                with self._stage('proxy') as stage:
+                    proxy = self.get_preview_proxy()
+                    stage['image'] = proxy
+                
+                # Show the output as it would appear fitted to the screen
+                target = self._output_size(self.source_size, resize, maintain_aspect)
+                preview_size = self._output_size(target, PREVIEW_PROXY_SIZE, True)
+                converted = self._resize_stage(proxy, preview_size, False)
+                
+                encoded = self._encode(converted, output_format, quality, effort)
+                with self._stage('decode_result') as stage:
+                    self.preview_image = open_image(BytesIO(encoded), [output_format])
+                    self.preview_image.load()
+                    stage['image'] = self.preview_image
+                self.preview_encoded_size = len(encoded)
+                
+                if cache_key:
+                    self.cache.put(cache_key, encoded, self.preview_image)
+            
+            self.preview_settings = (output_format, quality, resize, maintain_aspect)
+            
+            return True, f"Preview of {output_format} ready"
             
         except Exception as e:
             return False, f"Conversion error: {str(e)}"
     
-    def save_image(self, output_path, output_format=None, quality=None):
+    def needs_conversion(self, output_format, quality, resize=None, maintain_aspect=True, effort=None):
+        """Check whether processed_image is stale for the given settings"""
+        output_format = self._normalize_format(output_format)
+        return (not self._has_encoded(output_format, quality, effort)
+                or resize != self.current_resize
+                or (resize is not None and maintain_aspect != self.current_maintain_aspect))
+    
+    @_instrumented
+    def save_image(self, output_path, output_format=None, quality=None, effort=None):
         """Save processed image"""
         if not self.processed_image:
             return False, "No processed image to save"
@@ -98,51 +387,130 @@ class ImageConverter:
             output_format = self.current_format
         if quality is None:
             quality = self.current_quality
+        if effort is None:
+            effort = self.current_effort
         
         try:
-            save_kwargs = {}
+            output_format = self._normalize_format(output_format)
+            unlink_shared(output_path)
             
-            if output_format.upper() in ['JPEG', 'JPG']:
-                save_kwargs = {'quality': quality, 'optimize': True}
-                # Ensure RGB mode for JPEG
-                image_to_save = self.processed_image
-                if image_to_save.mode in ['RGBA', 'P']:
+            # Write the bytes from convert_image as-is when the settings still match
+            if self._has_encoded(output_format, quality, effort):
+                with self._stage('write'):
+                    with open(output_path, 'wb') as f:
+                        f.write(self.encoded_data)
+                return True, f"Image saved to: {output_path}"
+            
+            save_kwargs = self._get_save_kwargs(output_format, quality, effort)
+            image_to_save = self.processed_image
+            
+            # Ensure RGB mode for JPEG
+            if output_format == 'JPEG' and image_to_save.mode in ['RGBA', 'P']:
+                with self._stage('mode_convert') as stage:
                     image_to_save = image_to_save.convert('RGB')
-            elif output_format.upper() == 'WEBP':
-                save_kwargs = {'quality': quality, 'method': 6}
-                image_to_save = self.processed_image
-            elif output_format.upper() == 'PNG':
-                save_kwargs = {'optimize': True}
-                image_to_save = self.processed_image
-            else:
-                image_to_save = self.processed_image
+                    stage['image'] = image_to_save
             
-            image_to_save.save(output_path, format=output_format.upper(), **save_kwargs)
+            # Encodes and writes in one go
+            load_plugins([output_format])
+            with self._stage('encode'):
+                image_to_save.save(output_path, format=output_format, **save_kwargs)
             return True, f"Image saved to: {output_path}"
             
         except Exception as e:
             return False, f"Save error: {str(e)}"
     
-    def get_preview_images(self, max_size=(300, 300)):
+    @_instrumented
+    def convert_file_streaming(self, source, destination, output_format, quality=85, resize=None,
+                               maintain_aspect=True, max_memory=256 * 1024 * 1024, effort=None):
+        """Convert a file too large to hold in memory, writing straight to destination
+        
+        Works in horizontal bands for uncompressed TIFF and BMP sources, see
+        streaming.stream_convert. Doesn't touch the loaded image.
+        """
+        output_format = self._normalize_format(output_format)
+        # Bands are decoded, resized and written interleaved, so this is one stage
+        with self._stage('stream'):
+            return stream_convert(source, destination, output_format, quality, resize, maintain_aspect,
+                                  max_memory, self._get_save_kwargs(output_format, quality, effort))
+    
+    @_instrumented
+    def convert_animation_file(self, source, destination, output_format, quality=85, resize=None,
+                               maintain_aspect=True, colors=None, effort=None):
+        """Convert an animated GIF, WEBP or APNG frame by frame, writing straight to destination
+        
+        Returns (success, message, frames) with the timing of each frame, see
+        animation.convert_animation. Doesn't touch the loaded image.
+        """
+        return convert_animation(source, destination, output_format, quality, resize, maintain_aspect,
+                                 colors, effort or self.effort, self._metrics)
+    
+    @_instrumented
+    def get_preview_images(self, max_size=PREVIEW_THUMBNAIL_SIZE):
         """Get images for preview - now reflects actual quality"""
         if not self.original_image:
             return None, None
         
-        # Original preview
-        original_preview = self.original_image.copy()
-        original_preview.thumbnail(max_size, Image.Resampling.LANCZOS)
+        # Original preview, computed once per loaded file from the proxy
+        if not self.original_thumbnail or self.original_thumbnail[0] != max_size:
+            with self._stage('original_thumbnail') as stage:
+                thumbnail = self.get_preview_proxy().copy()
+                thumbnail.thumbnail(max_size, Image.Resampling.LANCZOS)
+                self.original_thumbnail = (max_size, thumbnail)
+                stage['image'] = thumbnail
+        original_preview = self.original_thumbnail[1]
         
-        # Processed preview - use the actual processed image with quality applied
+        # Processed preview - use the actual processed image with quality applied,
+        # or the proxy conversion if one was made after it
         processed_preview = None
-        if self.processed_image:
-            processed_preview = self.processed_image.copy()
-            processed_preview.thumbnail(max_size, Image.Resampling.LANCZOS)
+        source = self.preview_image or self.processed_image
+        if source is self.processed_image and self.processed_thumbnail and max_size == PREVIEW_THUMBNAIL_SIZE:
+            processed_preview = self.processed_thumbnail
+        elif source:
+            # processed_image is opened lazily from the encoded bytes
+            with self._stage('decode_result') as stage:
+                source.load()
+                stage['image'] = source
+            with self._stage('processed_thumbnail') as stage:
+                processed_preview = source.copy()
+                processed_preview.thumbnail(max_size, Image.Resampling.LANCZOS)
+                stage['image'] = processed_preview
+            
+            # Keep the full conversion's thumbnail alongside its cached bytes
+            if source is self.processed_image and max_size == PREVIEW_THUMBNAIL_SIZE:
+                self.processed_thumbnail = processed_preview
+                if self.current_cache_key:
+                    self.cache.set_preview(self.current_cache_key, processed_preview)
         
         return original_preview, processed_preview
     
-    def estimate_file_size(self, output_format=None, quality=None):
-        """Estimate output file size"""
-        if not self.processed_image:
+    def get_fidelity(self):
+        """PSNR and SSIM of the latest conversion against its source, or None
+        
+        Compares the decoded preview with the proxy after a preview, or the
+        decoded full conversion with original_image, on a downscaled luma
+        plane. Returns a dict with 'psnr' (dB) and 'ssim'.
+        """
+        if self.preview_image:
+            reference, candidate = self.get_preview_proxy(), self.preview_image
+        elif self.processed_image:
+            reference, candidate = self.original_image, self.processed_image
+        else:
+            return None
+        
+        try:
+            from fidelity import compare
+            with self._stage('fidelity'):
+                return compare(reference, candidate)
+        except Exception:
+            return None
+    
+    def estimate_file_size(self, output_format=None, quality=None, effort=None):
+        """Estimate output file size
+        
+        Scaled from the preview when there is no full conversion, which is
+        encoded with the fast profile, so the estimate leans a little high.
+        """
+        if not self.processed_image and not self.preview_image:
             return "N/A"
         
         # Use current settings if not specified
@@ -150,19 +518,125 @@ class ImageConverter:
             output_format = self.current_format
         if quality is None:
             quality = self.current_quality
+        if effort is None:
+            effort = self.current_effort
         
         try:
-            buffer = BytesIO()
-            save_kwargs = {}
+            output_format = self._normalize_format(output_format)
+            
+            # A later preview at another size leaves the full conversion describing a different output
+            stale = False
+            if self.preview_image:
+                resize, maintain_aspect = self.preview_settings[2:]
+                stale = (resize != self.current_resize
+                         or (resize is not None and maintain_aspect != self.current_maintain_aspect))
+            
+            # Exact size for free when the settings match the last conversion
+            if not stale and self._has_encoded(output_format, quality, effort):
+                return f"{len(self.encoded_data) / 1024:.1f} KB"
+            
+            # Scale the proxy encode up by pixel count rather than encoding at full size
+            if self.preview_image and self.preview_settings[:2] == (output_format, quality):
+                target = self._output_size(self.source_size, *self.preview_settings[2:])
+                ratio = (target[0] * target[1]) / (self.preview_image.width * self.preview_image.height)
+                return f"~{self.preview_encoded_size * ratio / 1024:.1f} KB"
             
-            if output_format.upper() in ['JPEG', 'JPG']:
-                save_kwargs = {'quality': quality}
-            elif output_format.upper() == 'WEBP':
-                save_kwargs = {'quality': quality}
+            if not self.processed_image or stale:
+                return "N/A"
             
-            self.processed_image.save(buffer, format=output_format.upper(), **save_kwargs)
+            buffer = BytesIO()
+            save_kwargs = self._get_save_kwargs(output_format, quality, effort)
+            image_to_save = self.processed_image
+            if output_format == 'JPEG' and image_to_save.mode in ['RGBA', 'P']:
+                image_to_save = image_to_save.convert('RGB')
+            
+            load_plugins([output_format])
+            image_to_save.save(buffer, format=output_format, **save_kwargs)
             size_kb = len(buffer.getvalue()) / 1024
             return f"{size_kb:.1f} KB"
             
         except Exception:
-            return "N/A"
\ No newline at end of file
+            return "N/A"
+    
+    @_instrumented
+    def export_variants(self, variants, output_dir=None, max_workers=None):
+        """Produce several sizes and formats of the loaded image in one pass
+        
+        variants is a list of (size, format, quality) where size is a width
+        in pixels or a (width, height) box; the aspect ratio is kept and
+        images are never enlarged. The source is decoded once, each size is
+        resized from the next larger one, and encodes run concurrently since
+        Pillow releases the GIL while encoding. Returns (success, message,
+        results) with one dict per variant holding the encoded data, its
+        byte size, dimensions and, with output_dir, the written path.
+        """
+        if not self.original_image:
+            return False, "No image loaded", []
+        
+        try:
+            width, height = self.source_size
+            targets = []
+            for size, output_format, quality in variants:
+                box = (size, height) if isinstance(size, int) else tuple(size)
+                targets.append((size, self._normalize_format(output_format), quality,
+                                self._output_size(self.source_size, box, True)))
+            
+            # Decode once, at the smallest JPEG scale that covers the largest variant
+            largest = max(target[3] for target in targets)
+            with self._stage('decode') as stage:
+                if self.original_image.filename and self.original_image.tile:
+                    base = open_image(self.original_image.filename, [self.original_image.format])
+                    base.draft(base.mode, largest)
+                    base.load()
+                else:
+                    base = self.original_image
+                stage['image'] = base
+            
+            # Build sizes progressively from the largest down
+            resized = {}
+            current = base
+            for dimensions in sorted({target[3] for target in targets}, reverse=True):
+                if dimensions != current.size:
+                    with self._stage('resize') as stage:
+                        current = current.resize(dimensions, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                        stage['image'] = current
+                resized[dimensions] = current
+            
+            # Image.save stores encoder settings on the image, so variants sharing
+            # a size each get their own copy to encode from
+            used = set()
+            jobs = []
+            for size, output_format, quality, dimensions in targets:
+                image = resized[dimensions]
+                jobs.append((image.copy() if dimensions in used else image, output_format, quality))
+                used.add(dimensions)
+            
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                encoded = list(executor.map(lambda job: self._encode(*job), jobs))
+            
+            results = []
+            stem = os.path.splitext(os.path.basename(self.original_image.filename or "image"))[0]
+            for (size, output_format, quality, dimensions), data in zip(targets, encoded):
+                result = {
+                    'size': size,
+                    'format': output_format,
+                    'quality': quality,
+                    'dimensions': dimensions,
+                    'data': data,
+                    'bytes': len(data),
+                    'path': None,
+                }
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                    result['path'] = os.path.join(
+                        output_dir, f"{stem}_{dimensions[0]}w_q{quality}.{output_format.lower()}")
+                    unlink_shared(result['path'])
+                    with open(result['path'], 'wb') as f:
+                        f.write(data)
+                results.append(result)
+            
+            total_kb = sum(result['bytes'] for result in results) / 1024
+            return True, f"Exported {len(results)} variants ({total_kb:.1f} KB)", results
+            
+        except Exception as e:
+            return False, f"Export error: {str(e)}", []
@@ -0,0 +1,423 @@
+import importlib
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+from metrics import ConversionMetrics, measure
+
+# Formats where quality changes the output
+LOSSY_FORMATS = ['JPEG', 'WEBP']
+
+# Pillow plugin module for each format this app reads or writes. Importing
+# them directly avoids Image.init(), which imports every plugin Pillow ships
+PLUGINS = {
+    'JPEG': 'JpegImagePlugin',
+    'PNG': 'PngImagePlugin',
+    'WEBP': 'WebPImagePlugin',
+    'BMP': 'BmpImagePlugin',
+    'TIFF': 'TiffImagePlugin',
+    'GIF': 'GifImagePlugin',
+}
+INPUT_FORMATS = list(PLUGINS)
+EXTENSION_FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+    '.bmp': 'BMP',
+    '.tif': 'TIFF',
+    '.tiff': 'TIFF',
+    '.gif': 'GIF',
+}
+
+# Encoder settings per effort level. fast is meant for interactive previews,
+# max for final output; see the README for measured speed and size per format
+EFFORT_PROFILES = {
+    'fast': {
+        'JPEG': {'optimize': False},
+        'WEBP': {'method': 0},
+        'PNG': {'compress_level': 1},
+    },
+    'balanced': {
+        'JPEG': {'optimize': True},
+        'WEBP': {'method': 4},
+        'PNG': {'compress_level': 6},
+    },
+    'max': {
+        'JPEG': {'optimize': True, 'progressive': True},
+        'WEBP': {'method': 6},
+        'PNG': {'optimize': True},
+    },
+}
+EFFORTS = list(EFFORT_PROFILES)
+DEFAULT_EFFORT = 'max'
+PREVIEW_EFFORT = 'fast'
+
+
+class ConversionJob(namedtuple('ConversionJob', ['source', 'output_format', 'quality', 'resize',
+                                                 'maintain_aspect', 'max_bytes', 'effort', 'target_ssim'],
+                               defaults=[85, None, True, None, DEFAULT_EFFORT, None])):
+    """One conversion request: a file path or encoded bytes plus output settings
+
+    resize is a (width, height) box; with maintain_aspect the image is fitted
+    inside it and never enlarged. With max_bytes, quality is only the start
+    of a search for the highest quality whose output fits; with target_ssim
+    quality is ignored and the lowest quality reaching that SSIM is used.
+    effort is one of EFFORT_PROFILES.
+    """
+    __slots__ = ()
+
+
+class ConversionResult(namedtuple('ConversionResult', ['success', 'message', 'data', 'format', 'quality',
+                                                       'size', 'source_size', 'search', 'metrics'],
+                                  defaults=[None, None, None, None, None, None, None])):
+    """Outcome of a job: the encoded bytes, what they contain and how long each stage took
+
+    quality is the one actually used (the searched one with max_bytes) and
+    search the details of that search. metrics is a ConversionMetrics.
+    """
+    __slots__ = ()
+
+
+def normalize_format(output_format):
+    """Map format aliases to the name Pillow expects"""
+    output_format = output_format.upper()
+    return "JPEG" if output_format == "JPG" else output_format
+
+
+def load_plugins(formats):
+    """Import the Pillow plugins for formats, so open and save don't fall back to Image.init()"""
+    for image_format in formats:
+        if image_format in PLUGINS:
+            importlib.import_module(f"PIL.{PLUGINS[image_format]}")
+
+
+def guess_format(path):
+    """Format a file probably holds, from its extension, or None"""
+    if not isinstance(path, (str, os.PathLike)):
+        return None
+    return EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def open_image(fp, formats=None):
+    """Image.open that only loads the plugins it needs
+
+    formats (e.g. the format guessed from the extension, or the one just
+    encoded) are tried first, then the other input formats. Only if those
+    fail are all of Pillow's plugins loaded.
+    """
+    formats = [image_format for image_format in formats or [] if image_format]
+    if formats:
+        load_plugins(formats)
+        try:
+            return Image.open(fp, formats=formats)
+        except UnidentifiedImageError:
+            pass
+
+    load_plugins(INPUT_FORMATS)
+    try:
+        return Image.open(fp, formats=INPUT_FORMATS)
+    except UnidentifiedImageError:
+        # Some other format Pillow knows, at the cost of loading every plugin
+        return Image.open(fp)
+
+
+def unlink_shared(path):
+    """Remove path if other names hard link to it, so writing it doesn't change them
+
+    Batch deduplication links one output under several names, and every
+    writer opens its destination in place.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_save_kwargs(output_format, quality, effort=DEFAULT_EFFORT):
+    """Encoder settings shared by every conversion path"""
+    if effort not in EFFORT_PROFILES:
+        raise ValueError(f"unknown effort '{effort}', expected one of {', '.join(EFFORTS)}")
+    save_kwargs = dict(EFFORT_PROFILES[effort].get(output_format, {}))
+    if output_format in LOSSY_FORMATS:
+        save_kwargs['quality'] = quality
+    return save_kwargs
+
+
+def output_size(size, resize, maintain_aspect):
+    """Compute the size resize_image would produce without touching pixels"""
+    if not resize:
+        return size
+    if not maintain_aspect:
+        return resize
+    scale = min(resize[0] / size[0], resize[1] / size[1], 1)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def resize_image(image, resize, maintain_aspect):
+    """Resize a copy of image, returning image itself when nothing changes"""
+    if not resize or resize == image.size:
+        return image
+    if maintain_aspect:
+        # Maintain aspect ratio
+        resized = image.copy()
+        resized.thumbnail(resize, Image.Resampling.LANCZOS)
+        return resized
+    # Force exact size, letting reduce() do the bulk of large downscales
+    return image.resize(resize, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def encode(image, output_format, quality, metrics=None, effort=DEFAULT_EFFORT):
+    """Encode image with the shared settings and return the bytes"""
+    # Handle format-specific conversions
+    if output_format == 'JPEG' and image.mode in ['RGBA', 'P']:
+        with measure(metrics, 'mode_convert') as stage:
+            image = image.convert('RGB')
+            stage['image'] = image
+
+    load_plugins([output_format])
+    with measure(metrics, 'encode'):
+        buffer = BytesIO()
+        image.save(buffer, format=output_format, **get_save_kwargs(output_format, quality, effort))
+        return buffer.getvalue()
+
+
+def search_quality(image, output_format, max_bytes, start_quality=85, max_iterations=8, metrics=None,
+                   effort=DEFAULT_EFFORT):
+    """Find the highest quality whose encode fits in max_bytes
+
+    Bisects over quality 1-100 starting from start_quality, keeping the
+    best fitting encode. Returns (quality, data, iterations); if nothing
+    fits, the quality 1 encode is returned.
+    """
+    # Lossless formats have nothing to search over
+    if output_format not in LOSSY_FORMATS:
+        return start_quality, encode(image, output_format, start_quality, metrics, effort), 1
+
+    low, high = 1, 100
+    probe = max(low, min(high, start_quality))
+    best_quality, best_data, smallest = None, None, None
+    iterations = 0
+
+    while low <= high and iterations < max_iterations:
+        data = encode(image, output_format, probe, metrics, effort)
+        iterations += 1
+
+        if len(data) <= max_bytes:
+            best_quality, best_data = probe, data
+            low = probe + 1
+        else:
+            if probe == 1:
+                smallest = data
+            high = probe - 1
+        probe = (low + high) // 2
+
+    if best_data is None:
+        # Even the lowest quality doesn't fit, return it as the closest result
+        if smallest is None:
+            smallest = encode(image, output_format, 1, metrics, effort)
+            iterations += 1
+        return 1, smallest, iterations
+
+    return best_quality, best_data, iterations
+
+
+def search_ssim(image, output_format, target_ssim, effort=DEFAULT_EFFORT, max_iterations=8, metrics=None):
+    """Find the lowest quality whose decoded output reaches target_ssim against image
+
+    Every candidate is encoded, decoded from the in-memory buffer and
+    compared on a luma plane shrunk at most 2x, see fidelity. Returns (quality,
+    data, score, iterations); if even quality 100 misses the target, its
+    encode is returned.
+    """
+    from fidelity import luma_plane, sampled_ssim
+
+    # Lossless formats reproduce the image exactly
+    if output_format not in LOSSY_FORMATS:
+        return 100, encode(image, output_format, 100, metrics, effort), 1.0, 1
+
+    with measure(metrics, 'fidelity'):
+        reference = luma_plane(image)
+
+    low, high = 1, 100
+    best, highest = None, None
+    iterations = 0
+
+    while low <= high and iterations < max_iterations:
+        probe = (low + high) // 2
+        data = encode(image, output_format, probe, metrics, effort)
+        iterations += 1
+
+        with measure(metrics, 'fidelity'):
+            with open_image(BytesIO(data), [output_format]) as decoded:
+                score = sampled_ssim(reference, luma_plane(decoded, size=reference.shape[::-1]))
+
+        if score >= target_ssim:
+            best = (probe, data, score)
+            high = probe - 1
+        else:
+            if probe == 100:
+                highest = (probe, data, score)
+            low = probe + 1
+
+    if best is None:
+        # Not even the highest quality gets there, return it as the closest result
+        if highest is None:
+            data = encode(image, output_format, 100, metrics, effort)
+            iterations += 1
+            with measure(metrics, 'fidelity'):
+                with open_image(BytesIO(data), [output_format]) as decoded:
+                    score = sampled_ssim(reference, luma_plane(decoded, size=reference.shape[::-1]))
+            highest = (100, data, score)
+        return highest + (iterations,)
+
+    return best + (iterations,)
+
+
+def open_source(source, resize=None, maintain_aspect=True):
+    """Open a path or encoded bytes, decoding JPEGs at the smallest DCT scale covering the output size"""
+    if isinstance(source, (bytes, bytearray)):
+        image = open_image(BytesIO(source))
+    else:
+        image = open_image(source, [guess_format(source)])
+    if resize:
+        image.draft(image.mode, output_size(image.size, resize, maintain_aspect))
+    return image
+
+
+def convert_loaded(image, job, metrics=None):
+    """Convert an already opened image for job, returning a ConversionResult
+
+    Errors are raised rather than returned, run_job turns them into results.
+    """
+    output_format = normalize_format(job.output_format)
+    if job.max_bytes and job.target_ssim:
+        raise ValueError("max_bytes and target_ssim can't be combined")
+
+    with measure(metrics, 'decode') as stage:
+        image.load()
+        stage['image'] = image
+
+    with measure(metrics, 'resize') as stage:
+        converted = resize_image(image, job.resize, job.maintain_aspect)
+        stage['image'] = converted
+
+    if job.target_ssim:
+        quality, data, score, iterations = search_ssim(converted, output_format, job.target_ssim, job.effort,
+                                                       metrics=metrics)
+        search = {
+            'quality': quality,
+            'size': len(data),
+            'target_ssim': job.target_ssim,
+            'ssim': score,
+            'fits': score >= job.target_ssim,
+            'iterations': iterations,
+        }
+        size_kb = len(data) / 1024
+        if not search['fits']:
+            message = (f"Conversion to {output_format} can't reach SSIM {job.target_ssim:g}, "
+                       f"highest quality gives {score:.3f} ({size_kb:.1f} KB, {iterations} encodes)")
+        else:
+            message = (f"Conversion to {output_format} at quality {quality} "
+                       f"(SSIM {score:.3f}, {size_kb:.1f} KB, {iterations} encodes)")
+        return ConversionResult(True, message, data, output_format, quality, converted.size, image.size,
+                                search, metrics)
+
+    if not job.max_bytes:
+        data = encode(converted, output_format, job.quality, metrics, job.effort)
+        return ConversionResult(True, f"Conversion to {output_format} successful", data, output_format,
+                                job.quality, converted.size, image.size, None, metrics)
+
+    # Resize once, every probe encodes the same pixels
+    quality, data, iterations = search_quality(converted, output_format, job.max_bytes, job.quality,
+                                               metrics=metrics, effort=job.effort)
+    search = {
+        'quality': quality,
+        'size': len(data),
+        'max_bytes': job.max_bytes,
+        'fits': len(data) <= job.max_bytes,
+        'iterations': iterations,
+    }
+
+    size_kb = len(data) / 1024
+    if not search['fits']:
+        message = (f"Conversion to {output_format} can't reach {job.max_bytes / 1024:.1f} KB, "
+                   f"lowest quality gives {size_kb:.1f} KB ({iterations} encodes)")
+    else:
+        message = f"Conversion to {output_format} at quality {quality} ({size_kb:.1f} KB, {iterations} encodes)"
+    return ConversionResult(True, message, data, output_format, quality, converted.size, image.size,
+                            search, metrics)
+
+
+def run_job(job):
+    """Open, convert and encode one job without any shared state
+
+    Safe to call from any number of threads or processes at once. Always
+    returns a ConversionResult, with success False and the error in message
+    if anything fails.
+    """
+    metrics = ConversionMetrics('run_job')
+    try:
+        with measure(metrics, 'open'):
+            image = open_source(job.source)
+            source_size = image.size
+            if job.resize:
+                # Draft to the fitted size, the resize box can be far larger on one side
+                image.draft(image.mode, output_size(source_size, job.resize, job.maintain_aspect))
+
+        with image:
+            result = convert_loaded(image, job, metrics)
+        return result._replace(source_size=source_size)
+
+    except Exception as e:
+        return ConversionResult(False, f"Conversion error: {str(e)}", metrics=metrics)
+
+
+class AsyncConverter:
+    """Run conversion jobs from asyncio code, at most max_concurrency at a time
+
+    Jobs run on executor, by default a thread pool of max_concurrency threads;
+    Pillow releases the GIL while decoding, resizing and encoding. A process
+    pool works too since jobs and results pickle. Jobs past the limit wait
+    in the event loop rather than in the executor's queue, so cancelling
+    them is cheap.
+    """
+
+    def __init__(self, max_concurrency=None, executor=None):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self.owns_executor = executor is None
+        # Created on first use so it belongs to the running loop
+        self.semaphore = None
+
+    async def convert(self, job):
+        """Convert one job, returning its ConversionResult"""
+        # Imported here so synchronous users don't pay for asyncio at startup
+        import asyncio
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, run_job, job)
+
+    async def convert_many(self, jobs):
+        """Convert jobs concurrently, returning results in the same order"""
+        import asyncio
+
+        return await asyncio.gather(*(self.convert(job) for job in jobs))
+
+    def close(self):
+        """Shut down the executor if this converter created it"""
+        if self.owns_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
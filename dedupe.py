@@ -0,0 +1,152 @@
+"""Perceptual-hash index of converted images, so near-duplicates reuse an output
+
+dhash() shrinks an image to a 9x8 grayscale thumbnail, decoded at the
+smallest JPEG scale that covers it, and keeps one bit per comparison of
+horizontal neighbours. Re-encodes and resized copies of a photo end up
+within a few bits of each other, while different photos differ in about
+half of the 64.
+
+DuplicateIndex stores hash -> output on disk, so later batch runs can link
+an existing output instead of converting a near-identical source again.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+INDEX_NAME = ".imageconverter-dedupe.json"
+INDEX_VERSION = 1
+
+# Rows of the difference hash; 8 gives 64 bits
+HASH_SIZE = 8
+
+# Bits two hashes may differ in and still count as duplicates
+DEFAULT_MAX_DISTANCE = 4
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Difference hash of an opened image as a hex string
+
+    Uses draft() so JPEGs decode straight to grayscale at 1/8 scale or
+    less; other formats decode once and are shrunk with reduce().
+    """
+    image.draft('L', (hash_size * 8, hash_size * 8))
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = np.asarray(small, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def hamming(hashes, value):
+    """Bits each row of hashes (a uint8 array, one hash per row) differs from the hex hash value"""
+    difference = np.bitwise_xor(hashes, np.frombuffer(bytes.fromhex(value), dtype=np.uint8))
+    return np.unpackbits(difference, axis=1).sum(axis=1)
+
+
+def link_output(existing, destination):
+    """Make destination a hard link to existing, copying where links aren't possible
+
+    Returns how the output was reused: "kept" when destination already is
+    existing, otherwise "linked" or "copied".
+    """
+    if os.path.exists(destination) and os.path.samefile(existing, destination):
+        return "kept"
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(existing, destination)
+        return "linked"
+    except OSError:
+        shutil.copyfile(existing, destination)
+        return "copied"
+
+
+class DuplicateIndex:
+    """Perceptual hashes of converted sources and the outputs they produced
+
+    Entries are grouped by conversion settings and output dimensions (see
+    group_key), so an output is only reused for a source that would have
+    been converted to the same size with the same settings. Outputs added
+    with pending=True count as present until release() or remove() is
+    called, which lets sources of one run match others still converting.
+    """
+
+    def __init__(self, path, max_distance=DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.groups = {}
+        self.pending = set()
+        # Hashes of each group as a uint8 array, rebuilt after changes
+        self.arrays = {}
+        self.load()
+
+    @staticmethod
+    def group_key(settings, size, frames=1):
+        """Group of sources whose outputs are interchangeable"""
+        return f"{size[0]}x{size[1]}x{frames} {json.dumps(settings, sort_keys=True)}"
+
+    def load(self):
+        """Read the index left by an earlier run, starting empty if there is none"""
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.groups = index.get('groups', {})
+
+    def save(self):
+        """Write the index atomically, leaving out outputs that were never written"""
+        groups = {}
+        for key, entries in self.groups.items():
+            kept = [entry for entry in entries if entry['output'] not in self.pending]
+            if kept:
+                groups[key] = kept
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'groups': groups}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def find(self, value, key):
+        """Output of the closest entry within max_distance of the hex hash value, or None"""
+        entries = self.groups.get(key)
+        if not entries:
+            return None
+        if key not in self.arrays:
+            self.arrays[key] = np.array([list(bytes.fromhex(entry['hash'])) for entry in entries], dtype=np.uint8)
+
+        distances = hamming(self.arrays[key], value)
+        for position in np.argsort(distances, kind='stable'):
+            if distances[position] > self.max_distance:
+                break
+            output = entries[position]['output']
+            if output in self.pending or os.path.exists(output):
+                return output
+        return None
+
+    def add(self, value, key, source, output, pending=False):
+        """Record that source, hashing to value, was converted to output"""
+        output = os.path.abspath(output)
+        # A rewritten output no longer holds what older entries point at
+        self.remove(output)
+        self.groups.setdefault(key, []).append({'hash': value, 'source': os.path.abspath(source), 'output': output})
+        self.arrays.pop(key, None)
+        if pending:
+            self.pending.add(output)
+
+    def release(self, output):
+        """Mark a pending output as written"""
+        self.pending.discard(os.path.abspath(output))
+
+    def remove(self, output):
+        """Forget every entry pointing at output"""
+        output = os.path.abspath(output)
+        self.pending.discard(output)
+        for key, entries in self.groups.items():
+            kept = [entry for entry in entries if entry['output'] != output]
+            if len(kept) != len(entries):
+                self.groups[key] = kept
+                self.arrays.pop(key, None)
@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+# Longest side the luma planes are shrunk to, within MAX_DOWNSCALE
+METRIC_SIZE = 512
+
+# Most a plane is ever shrunk; further downscaling averages compression artifacts away
+MAX_DOWNSCALE = 2
+
+# Larger planes are scored on evenly spread tiles covering about this many pixels
+METRIC_PIXELS = 1024 * 1024
+TILE_SIZE = 256
+
+# Side of the square SSIM window
+SSIM_WINDOW = 7
+
+# SSIM stabilizing constants for 8-bit data
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def luma_plane(image, size=None, max_size=METRIC_SIZE, max_downscale=MAX_DOWNSCALE):
+    """Luma of image as a float array, scaled to size or to fit max_size
+
+    The image is never shrunk by more than max_downscale, so large images
+    give planes larger than max_size. Converting to L first means only one
+    channel gets resampled. BOX averaging is enough for a downscale that
+    only feeds the metrics.
+    """
+    plane = image.convert('L') if image.mode != 'L' else image
+    if size is None:
+        scale = max(min(max_size / plane.width, max_size / plane.height, 1), 1 / max_downscale)
+        size = (max(1, round(plane.width * scale)), max(1, round(plane.height * scale)))
+    if plane.size != size:
+        plane = plane.resize(size, Image.Resampling.BOX)
+    return np.asarray(plane, dtype=np.float64)
+
+
+def _box_mean(values, window):
+    """Mean over every window x window block, for valid positions only"""
+    sums = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    sums[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    block = (sums[window:, window:] - sums[:-window, window:]
+             - sums[window:, :-window] + sums[:-window, :-window])
+    return block / (window * window)
+
+
+def psnr(reference, candidate):
+    """Peak signal-to-noise ratio in dB between two planes of the same shape"""
+    mse = np.mean((reference - candidate) ** 2)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def ssim(reference, candidate, window=SSIM_WINDOW):
+    """Mean structural similarity between two planes of the same shape
+
+    Uses a uniform window with sample covariances, like scikit-image's
+    default, computed with summed-area tables so every statistic is a few
+    array operations.
+    """
+    window = max(2, min(window, *reference.shape))
+    mean_x = _box_mean(reference, window)
+    mean_y = _box_mean(candidate, window)
+
+    # Sample rather than population (co)variances
+    correction = window * window / (window * window - 1)
+    var_x = (_box_mean(reference * reference, window) - mean_x * mean_x) * correction
+    var_y = (_box_mean(candidate * candidate, window) - mean_y * mean_y) * correction
+    covariance = (_box_mean(reference * candidate, window) - mean_x * mean_y) * correction
+
+    similarity = (((2 * mean_x * mean_y + SSIM_C1) * (2 * covariance + SSIM_C2))
+                  / ((mean_x * mean_x + mean_y * mean_y + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+    return float(similarity.mean())
+
+
+def tiles(shape, max_pixels=METRIC_PIXELS, tile=TILE_SIZE):
+    """Slices of evenly spread tiles covering about max_pixels of a plane, or the whole plane"""
+    height, width = shape
+    if height * width <= max_pixels:
+        return [(slice(None), slice(None))]
+    tile_height, tile_width = min(tile, height), min(tile, width)
+    count = max(1, max_pixels // (tile_height * tile_width))
+    rows = max(1, min(count, round(math.sqrt(count * height / width))))
+    columns = max(1, count // rows)
+    return [(slice(top, top + tile_height), slice(left, left + tile_width))
+            for top in np.linspace(0, height - tile_height, rows).astype(int)
+            for left in np.linspace(0, width - tile_width, columns).astype(int)]
+
+
+def sampled_ssim(reference, candidate):
+    """ssim, averaged over tiles() when the planes are too large to score whole"""
+    return float(np.mean([ssim(reference[box], candidate[box]) for box in tiles(reference.shape)]))
+
+
+def compare(reference, candidate, max_size=METRIC_SIZE):
+    """PSNR and SSIM of candidate against reference, both PIL images
+
+    The reference is scaled to the candidate's (reduced) dimensions, so a
+    resized output is compared with the source at the same size.
+    """
+    candidate_plane = luma_plane(candidate, max_size=max_size)
+    reference_plane = luma_plane(reference, size=candidate_plane.shape[::-1])
+    return {
+        'psnr': psnr(reference_plane, candidate_plane),
+        'ssim': sampled_ssim(reference_plane, candidate_plane),
+    }
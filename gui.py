@@ -3,12 +3,18 @@ from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
 import os
 from pathlib import Path
+from core import DEFAULT_EFFORT, EFFORTS
+from worker import ConversionWorker
 
 class ImageConverterGUI:
     def __init__(self, root, converter):
         self.root = root
         self.converter = converter
         self.current_file = None
+        self.image_size = None
+        self.has_conversion = False
+        # All converter calls go through the worker so the event loop never blocks
+        self.worker = ConversionWorker(root, on_busy_change=self.on_busy_change)
         self.setup_ui()
         
     def setup_ui(self):
@@ -27,7 +33,7 @@ class ImageConverterGUI:
         """Create sidebar with controls"""
         sidebar = ctk.CTkFrame(self.root, width=250, corner_radius=0)
         sidebar.grid(row=0, column=0, sticky="nsew")
-        sidebar.grid_rowconfigure(10, weight=1)
+        sidebar.grid_rowconfigure(13, weight=1)
         
         # Title
         title_label = ctk.CTkLabel(sidebar, text="Image Converter", 
@@ -68,12 +74,29 @@ class ImageConverterGUI:
         self.quality_label = ctk.CTkLabel(sidebar, text="85%")
         self.quality_label.grid(row=8, column=0, padx=20, pady=(0,10))
         
+        # Auto quality: Convert picks the lowest quality reaching the SSIM target
+        auto_frame = ctk.CTkFrame(sidebar, fg_color="transparent")
+        auto_frame.grid(row=9, column=0, padx=20, pady=5, sticky="ew")
+        
+        self.auto_quality = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(auto_frame, text="Auto quality, SSIM", 
+                      variable=self.auto_quality).grid(row=0, column=0, sticky="w")
+        self.ssim_var = ctk.StringVar(value="0.95")
+        ctk.CTkEntry(auto_frame, textvariable=self.ssim_var, width=60).grid(row=0, column=1, padx=(5,0))
+        
+        # Encoder effort for saved output, previews always use the fast profile
+        ctk.CTkLabel(sidebar, text="Effort:").grid(row=10, column=0, padx=20, pady=(5,5), sticky="w")
+        
+        self.effort_var = ctk.StringVar(value=DEFAULT_EFFORT)
+        effort_combo = ctk.CTkComboBox(sidebar, values=EFFORTS, variable=self.effort_var)
+        effort_combo.grid(row=11, column=0, padx=20, pady=5, sticky="ew")
+        
         # Resize options
         ctk.CTkLabel(sidebar, text="Resize:", 
-                   font=ctk.CTkFont(weight="bold")).grid(row=9, column=0, padx=20, pady=(15,5), sticky="w")
+                   font=ctk.CTkFont(weight="bold")).grid(row=12, column=0, padx=20, pady=(15,5), sticky="w")
         
         resize_frame = ctk.CTkFrame(sidebar, fg_color="transparent")
-        resize_frame.grid(row=10, column=0, padx=20, pady=5, sticky="ew")
+        resize_frame.grid(row=13, column=0, padx=20, pady=5, sticky="ew")
         resize_frame.grid_columnconfigure(0, weight=1)
         resize_frame.grid_columnconfigure(1, weight=1)
         
@@ -91,18 +114,24 @@ class ImageConverterGUI:
         self.maintain_aspect = ctk.BooleanVar(value=True)
         aspect_check = ctk.CTkCheckBox(sidebar, text="Maintain aspect ratio", 
                                      variable=self.maintain_aspect)
-        aspect_check.grid(row=11, column=0, padx=20, pady=5, sticky="w")
+        aspect_check.grid(row=14, column=0, padx=20, pady=5, sticky="w")
         
         # Convert button
         self.convert_btn = ctk.CTkButton(sidebar, text="Convert Image", 
                                        command=self.convert_image, state="disabled")
-        self.convert_btn.grid(row=12, column=0, padx=20, pady=20)
+        self.convert_btn.grid(row=15, column=0, padx=20, pady=20)
         
         # Save button
         self.save_btn = ctk.CTkButton(sidebar, text="Save Image", 
                                     command=self.save_image, state="disabled",
                                     fg_color="#2B8C44", hover_color="#247A3A")
-        self.save_btn.grid(row=13, column=0, padx=20, pady=(0,20))
+        self.save_btn.grid(row=16, column=0, padx=20, pady=(0,20))
+        
+        # Optional per-stage breakdown of each conversion
+        self.show_timings = ctk.BooleanVar(value=False)
+        timings_check = ctk.CTkCheckBox(sidebar, text="Show stage timings",
+                                      variable=self.show_timings, command=self.on_timings_change)
+        timings_check.grid(row=17, column=0, padx=20, pady=(0,20), sticky="w")
         
     def create_main_content(self):
         """Create main content area with image previews"""
@@ -154,33 +183,84 @@ class ImageConverterGUI:
                                     font=ctk.CTkFont(size=12))
         self.size_info.grid(row=2, column=0, pady=10)
         
+        # Background work progress
+        self.progress_bar = ctk.CTkProgressBar(main_frame, mode="indeterminate")
+        self.progress_bar.grid(row=3, column=0, padx=20, pady=(0,5), sticky="ew")
+        self.progress_bar.grid_remove()
+        
+        self.status_label = ctk.CTkLabel(main_frame, text="", font=ctk.CTkFont(size=12))
+        self.status_label.grid(row=4, column=0, pady=(0,10))
+        
+        self.timings_label = ctk.CTkLabel(main_frame, text="", font=ctk.CTkFont(family="Courier", size=11),
+                                        justify="left")
+        self.timings_label.grid(row=5, column=0, padx=20, pady=(0,10), sticky="w")
+        self.timings_label.grid_remove()
+        
     def load_image(self):
         """Load image file"""
         file_path = filedialog.askopenfilename(
             title="Select Image",
             filetypes=[
-                ("Image files", "*.jpg *.jpeg *.png *.webp *.bmp *.tiff"),
+                ("Image files", "*.jpg *.jpeg *.png *.webp *.bmp *.tif *.tiff *.gif"),
                 ("JPEG", "*.jpg *.jpeg"),
                 ("PNG", "*.png"),
                 ("WEBP", "*.webp"),
+                ("GIF", "*.gif"),
                 ("All files", "*.*")
             ]
         )
         
         if file_path:
-            success, message = self.converter.load_image(file_path)
-            if success:
-                self.current_file = file_path
-                self.update_file_info()
-                self.update_previews()
-                self.convert_btn.configure(state="normal")
-                messagebox.showinfo("Success", message)
-            else:
-                messagebox.showerror("Error", message)
+            settings = self.get_settings(resize=False)
+            self.status_label.configure(text="Loading image...")
+            
+            def job():
+                success, message = self.converter.load_image(file_path)
+                snapshot = self.take_snapshot(settings) if success else None
+                return success, message, snapshot
+            
+            def done(result):
+                success, message, snapshot = result
+                self.status_label.configure(text="")
+                if success:
+                    self.current_file = file_path
+                    self.image_size = snapshot['info']['size'] if snapshot['info'] else None
+                    self.has_conversion = False
+                    self.update_file_info(snapshot['info'])
+                    self.update_previews(snapshot)
+                    self.convert_btn.configure(state="normal")
+                    messagebox.showinfo("Success", message)
+                else:
+                    messagebox.showerror("Error", message)
+            
+            # A new image makes any pending preview meaningless
+            self.worker.cancel("preview")
+            self.worker.submit("load", job, done)
+    
+    def take_snapshot(self, settings, quality=None):
+        """Render previews and size info on the worker thread
+
+        quality is the one the conversion actually used, when it differs
+        from the slider (auto quality picks its own).
+        """
+        original_preview, processed_preview = self.converter.get_preview_images()
+        converted_size = None
+        fidelity = None
+        if processed_preview:
+            converted_size = self.converter.estimate_file_size(settings['format'], quality or settings['quality'],
+                                                               settings['effort'])
+            fidelity = self.converter.get_fidelity()
+        return {
+            'info': self.converter.get_image_info(),
+            'original': original_preview,
+            'processed': processed_preview,
+            'converted_size': converted_size,
+            'fidelity': fidelity,
+            'quality': self.converter.current_quality,
+        }
     
-    def update_file_info(self):
+    def update_file_info(self, info):
         """Update file information display"""
-        info = self.converter.get_image_info()
         if info:
             text = (f"File: {info['filename']}\n"
                    f"Size: {info['size'][0]}x{info['size'][1]}\n"
@@ -188,9 +268,10 @@ class ImageConverterGUI:
                    f"File Size: {info['file_size']}")
             self.file_info.configure(text=text)
     
-    def update_previews(self):
+    def update_previews(self, snapshot):
         """Update image previews"""
-        original_preview, processed_preview = self.converter.get_preview_images()
+        original_preview = snapshot['original']
+        processed_preview = snapshot['processed']
         
         # Update original preview
         self.original_canvas.delete("all")
@@ -210,88 +291,219 @@ class ImageConverterGUI:
             self.converted_canvas.create_image(150, 150, image=photo)
             
             # Update size info
-            original_size = self.converter.get_image_info()['file_size']
-            converted_size = self.converter.estimate_file_size(self.format_var.get(), 
-                                                             self.quality_var.get())
-            self.size_info.configure(text=f"Original: {original_size} | Converted: {converted_size}")
+            original_size = snapshot['info']['file_size']
+            converted_size = snapshot['converted_size']
+            text = f"Original: {original_size} | Converted: {converted_size}"
+            if snapshot['fidelity']:
+                text += f" | SSIM {snapshot['fidelity']['ssim']:.3f}, PSNR {snapshot['fidelity']['psnr']:.1f} dB"
+            self.size_info.configure(text=text)
         else:
             self.converted_canvas.create_text(150, 150, text="Preview will appear here", 
                                             fill="white", font=("Arial", 12))
             self.size_info.configure(text="Original: N/A | Converted: N/A")
+        
+        if snapshot.get('timings'):
+            self.timings_label.configure(text=snapshot['timings'])
+    
+    def on_busy_change(self, busy):
+        """Show progress while the worker has jobs"""
+        if busy:
+            self.progress_bar.grid()
+            self.progress_bar.start()
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.grid_remove()
+    
+    def on_timings_change(self):
+        """Show or hide the stage breakdown"""
+        if self.show_timings.get():
+            self.timings_label.configure(text="Timings appear after the next conversion")
+            self.timings_label.grid()
+        else:
+            self.timings_label.grid_remove()
     
     def on_format_change(self, choice):
         """Handle format change"""
-        if self.converter.original_image:
-            self.convert_image()
+        if self.image_size:
+            self.preview_conversion()
     
     def on_quality_change(self, value):
         """Handle quality change"""
         self.quality_label.configure(text=f"{int(float(value))}%")
-        if self.converter.processed_image:
-            self.convert_image()
+        if self.has_conversion:
+            self.preview_conversion()
+    
+    def get_resize(self):
+        """Get resize dimensions from the entries, raises ValueError if invalid"""
+        width = int(self.width_var.get()) if self.width_var.get() != "Original" else None
+        height = int(self.height_var.get()) if self.height_var.get() != "Original" else None
+        
+        if width is not None and height is not None:
+            return (width, height)
+        elif width is not None:
+            return (width, self.image_size[1])
+        elif height is not None:
+            return (self.image_size[0], height)
+        return None
+    
+    def get_target_ssim(self):
+        """SSIM target when auto quality is on, raises ValueError if invalid"""
+        if not self.auto_quality.get():
+            return None
+        target = float(self.ssim_var.get())
+        if not 0 < target < 1:
+            raise ValueError(target)
+        return target
+    
+    def get_settings(self, resize=True):
+        """Read the current settings on the Tk thread for use by worker jobs"""
+        return {
+            'format': self.format_var.get(),
+            'quality': self.quality_var.get(),
+            'resize': self.get_resize() if resize else None,
+            'maintain_aspect': self.maintain_aspect.get(),
+            'effort': self.effort_var.get(),
+            'timings': self.show_timings.get(),
+        }
+    
+    def run_conversion(self, settings, preview=False, target_ssim=None):
+        """Convert on the worker thread and return the result with a snapshot"""
+        self.converter.collect_metrics = settings['timings']
+        success, message = self.converter.convert_image(
+            output_format=settings['format'],
+            quality=settings['quality'],
+            resize=settings['resize'],
+            maintain_aspect=settings['maintain_aspect'],
+            preview=preview,
+            effort=None if preview else settings['effort'],
+            target_ssim=target_ssim
+        )
+        if not success:
+            return success, message, None
+        
+        metrics = self.converter.last_metrics if settings['timings'] else None
+        snapshot = self.take_snapshot(settings, None if preview else self.converter.current_quality)
+        if metrics:
+            total = metrics.total() * 1000
+            snapshot['timings'] = f"{metrics.format()}\ntotal: {total:.1f} ms"
+        return success, message, snapshot
+    
+    def preview_conversion(self):
+        """Convert the screen-sized proxy only, for interactive setting changes"""
+        try:
+            settings = self.get_settings()
+        except ValueError:
+            # Dimensions may be mid-edit; the explicit convert reports the error
+            settings = self.get_settings(resize=False)
+        
+        def done(result):
+            success, message, snapshot = result
+            if success:
+                self.has_conversion = True
+                self.update_previews(snapshot)
+                self.save_btn.configure(state="normal")
+        
+        # Slider drags fire many events; only the last one in the window runs
+        self.worker.submit("preview", lambda: self.run_conversion(settings, preview=True),
+                           done, debounce=True)
     
     def convert_image(self):
         """Convert the image"""
-        if not self.converter.original_image:
+        if not self.image_size:
             return
         
         # Get resize dimensions
-        resize = None
         try:
-            width = int(self.width_var.get()) if self.width_var.get() != "Original" else None
-            height = int(self.height_var.get()) if self.height_var.get() != "Original" else None
-            
-            if width is not None and height is not None:
-                resize = (width, height)
-            elif width is not None:
-                resize = (width, self.converter.original_image.size[1])
-            elif height is not None:
-                resize = (self.converter.original_image.size[0], height)
+            settings = self.get_settings()
         except ValueError:
             messagebox.showerror("Error", "Invalid dimensions")
             return
+        try:
+            target_ssim = self.get_target_ssim()
+        except ValueError:
+            messagebox.showerror("Error", "SSIM target must be a number between 0 and 1")
+            return
         
-        success, message = self.converter.convert_image(
-            output_format=self.format_var.get(),
-            quality=self.quality_var.get(),
-            resize=resize,
-            maintain_aspect=self.maintain_aspect.get()
-        )
+        self.status_label.configure(text="Finding quality..." if target_ssim else "Converting...")
         
-        if success:
-            self.update_previews()
-            self.save_btn.configure(state="normal")
-        else:
-            messagebox.showerror("Error", message)
+        def done(result):
+            success, message, snapshot = result
+            self.status_label.configure(text="")
+            if success:
+                self.has_conversion = True
+                if target_ssim:
+                    # Show the quality that was picked so saving reuses it
+                    self.quality_var.set(snapshot['quality'])
+                    self.quality_label.configure(text=f"{snapshot['quality']}%")
+                    self.status_label.configure(text=message)
+                self.update_previews(snapshot)
+                self.save_btn.configure(state="normal")
+            else:
+                messagebox.showerror("Error", message)
+        
+        # Shares the preview key so newer settings supersede it and vice versa
+        self.worker.submit("preview", lambda: self.run_conversion(settings, target_ssim=target_ssim), done)
     
     def save_image(self):
         """Save the converted image"""
-        if not self.converter.processed_image:
+        if not self.has_conversion:
+            return
+        
+        try:
+            settings = self.get_settings()
+        except ValueError:
+            messagebox.showerror("Error", "Invalid dimensions")
+            return
+        try:
+            target_ssim = self.get_target_ssim()
+        except ValueError:
+            messagebox.showerror("Error", "SSIM target must be a number between 0 and 1")
             return
         
         # Suggest output filename
         original_name = Path(self.current_file).stem
-        output_format = self.format_var.get().lower()
+        output_format = settings['format'].lower()
         suggested_name = f"{original_name}_converted.{output_format}"
         
         file_path = filedialog.asksaveasfilename(
             title="Save Converted Image",
             initialfile=suggested_name,
             defaultextension=f".{output_format}",
-            filetypes=[(f"{self.format_var.get()} files", f"*.{output_format}")]
+            filetypes=[(f"{settings['format']} files", f"*.{output_format}")]
         )
         
         if file_path:
-            success, message = self.converter.save_image(
-                file_path, 
-                self.format_var.get(), 
-                self.quality_var.get()
-            )
+            def job():
+                # Previews only touch the proxy, so run the full-resolution conversion if stale
+                if self.converter.needs_conversion(settings['format'], settings['quality'],
+                                                   settings['resize'], settings['maintain_aspect'],
+                                                   settings['effort']):
+                    success, message = self.converter.convert_image(
+                        output_format=settings['format'],
+                        quality=settings['quality'],
+                        resize=settings['resize'],
+                        maintain_aspect=settings['maintain_aspect'],
+                        effort=settings['effort'],
+                        target_ssim=target_ssim
+                    )
+                    if not success:
+                        return success, message
+                # An auto quality conversion saves at the quality it found
+                return self.converter.save_image(file_path, settings['format'], self.converter.current_quality,
+                                                 settings['effort'])
             
-            if success:
-                messagebox.showinfo("Success", message)
-            else:
-                messagebox.showerror("Error", message)
+            def done(result):
+                success, message = result
+                self.status_label.configure(text="")
+                self.save_btn.configure(state="normal")
+                if success:
+                    messagebox.showinfo("Success", message)
+                else:
+                    messagebox.showerror("Error", message)
+            
+            self.status_label.configure(text="Saving...")
+            self.save_btn.configure(state="disabled")
+            self.worker.submit("save", job, done)
 
 # Run the application
 if __name__ == "__main__":
@@ -1,27 +1,206 @@
-import customtkinter as ctk
-from converter import ImageConverter
-from gui import ImageConverterGUI
+import argparse
+import sys
+
+from core import DEFAULT_EFFORT, EFFORTS
+
+OUTPUT_FORMATS = ["JPEG", "PNG", "WEBP", "BMP"]
+
+def parse_size(value):
+    """Parse a WIDTHxHEIGHT argument"""
+    try:
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}', expected WIDTHxHEIGHT")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Image Converter Pro")
+    commands = parser.add_subparsers(dest="command")
+
+    # Headless batch conversion
+    batch = commands.add_parser("batch", help="Convert a directory tree or a list of files")
+    batch.add_argument("inputs", nargs="+", help="Image files or directories")
+    batch.add_argument("-o", "--output-dir", required=True, help="Directory for converted images")
+    batch.add_argument("-f", "--format", default="JPEG", type=str.upper, choices=OUTPUT_FORMATS)
+    batch.add_argument("-q", "--quality", default=85, type=int)
+    batch.add_argument("--max-kb", type=float, help="Pick the highest quality that fits this size per image")
+    batch.add_argument("--target-ssim", type=float,
+                       help="Pick the lowest quality whose output reaches this SSIM (e.g. 0.95) per image")
+    batch.add_argument("--effort", default=DEFAULT_EFFORT, choices=EFFORTS,
+                       help="Encoder effort, trading speed for file size (default: max)")
+    batch.add_argument("--resize", type=parse_size, help="Target size as WIDTHxHEIGHT")
+    batch.add_argument("--exact", action="store_true", help="Force exact size instead of keeping aspect ratio")
+    batch.add_argument("--no-recursive", action="store_true", help="Don't descend into subdirectories")
+    batch.add_argument("-j", "--workers", type=int, help="Worker processes (default: CPU count)")
+    batch.add_argument("--max-in-flight", type=int, help="Maximum queued files (default: 4 per worker)")
+    batch.add_argument("--suffix", default="", help="Suffix added to output file names")
+    batch.add_argument("--max-memory-mb", type=int,
+                       help="Stream uncompressed TIFF/BMP inputs that would need more memory than this")
+    batch.add_argument("--cache-dir", help="Keep converted results here and reuse them for unchanged inputs")
+    batch.add_argument("--cache-mb", type=int,
+                       help="In-memory cache budget per worker in MB (64 with --cache-dir)")
+    batch.add_argument("--timings", action="store_true",
+                       help="Print wall time percentiles for each conversion stage")
+    batch.add_argument("--dedupe", action="store_true",
+                       help="Link the existing output for perceptual duplicates instead of converting them")
+    batch.add_argument("--dedupe-index",
+                       help="Duplicate index file, implies --dedupe (default: inside the output directory)")
+    batch.add_argument("--max-distance", type=int,
+                       help="Hash bits (of 64) near-duplicates may differ in (default: 4)")
+    batch.add_argument("--quiet", action="store_true", help="Only print errors and the summary")
+
+    # Keep an output directory in sync with a drop directory
+    watch = commands.add_parser("watch", help="Convert new and changed images in a directory as they appear")
+    watch.add_argument("source_dir", help="Directory to watch")
+    watch.add_argument("-o", "--output-dir", required=True, help="Directory for converted images")
+    watch.add_argument("-f", "--format", default="JPEG", type=str.upper, choices=OUTPUT_FORMATS)
+    watch.add_argument("-q", "--quality", default=85, type=int)
+    watch.add_argument("--max-kb", type=float, help="Pick the highest quality that fits this size per image")
+    watch.add_argument("--effort", default=DEFAULT_EFFORT, choices=EFFORTS,
+                       help="Encoder effort, trading speed for file size (default: max)")
+    watch.add_argument("--resize", type=parse_size, help="Target size as WIDTHxHEIGHT")
+    watch.add_argument("--exact", action="store_true", help="Force exact size instead of keeping aspect ratio")
+    watch.add_argument("--suffix", default="", help="Suffix added to output file names")
+    watch.add_argument("-j", "--workers", type=int, help="Worker processes (default: CPU count)")
+    watch.add_argument("--interval", type=float, default=2.0, help="Seconds between scans (default: 2)")
+    watch.add_argument("--manifest", help="Manifest file (default: inside the output directory)")
+    watch.add_argument("--once", action="store_true", help="Scan once and exit")
+    watch.add_argument("--quiet", action="store_true", help="Only print errors")
+
+    # Local conversion service
+    serve = commands.add_parser("serve", help="Run a local HTTP conversion service")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("-j", "--workers", type=int, help="Worker processes (default: CPU count)")
+    serve.add_argument("--max-queue", type=int,
+                       help="Conversions waiting for a worker before answering 429 (default: 2 per worker)")
+    serve.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+def run_batch(args):
+    from batch import BatchConverter
+
+    batch = BatchConverter(
+        args.output_dir,
+        output_format=args.format,
+        quality=args.quality,
+        resize=args.resize,
+        maintain_aspect=not args.exact,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        suffix=args.suffix,
+        cache_dir=args.cache_dir,
+        cache_bytes=args.cache_mb * 1024 * 1024 if args.cache_mb else None,
+        max_bytes=int(args.max_kb * 1024) if args.max_kb else None,
+        max_memory=args.max_memory_mb * 1024 * 1024 if args.max_memory_mb else None,
+        collect_metrics=args.timings,
+        effort=args.effort,
+        target_ssim=args.target_ssim,
+        dedupe=args.dedupe,
+        dedupe_index=args.dedupe_index,
+        max_distance=args.max_distance
+    )
+
+    def report(result):
+        if not result['success']:
+            print(f"FAILED {result['source']}: {result['message']}", file=sys.stderr)
+        elif not args.quiet:
+            details = f"{result['seconds']:.2f}s"
+            if result.get('duplicate_of'):
+                details = result['message']
+            if result.get('frames'):
+                details += f", {result['frames']} frames"
+            if result['search']:
+                search = result['search']
+                details += f", quality {search['quality']} in {search['iterations']} encodes"
+                if 'ssim' in search:
+                    details += f", SSIM {search['ssim']:.3f}"
+                if not search['fits']:
+                    details += ", below SSIM target" if 'ssim' in search else ", over size budget"
+            print(f"{result['source']} -> {result['destination']} ({details})")
+
+    summary = batch.run(args.inputs, recursive=not args.no_recursive, on_result=report)
+
+    print(f"Converted {summary['succeeded']}/{summary['total']} images "
+          f"in {summary['elapsed']:.1f}s ({summary['images_per_sec']:.1f} images/sec), "
+          f"{summary['failed']} failed, {summary['cached']} from cache")
+    if 'duplicates' in summary:
+        print(f"{summary['duplicates']} duplicates reused an existing output "
+              f"(hashing took {summary['hash_seconds']:.1f}s)")
+    if args.timings:
+        print(batch.metrics.format())
+    return 1 if summary['failed'] else 0
+
+def run_watch(args):
+    from watch import WatchFolder
+
+    def report(kind, source, message):
+        if kind == "failed":
+            print(f"FAILED {source}: {message}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{kind} {source}")
+
+    watcher = WatchFolder(
+        args.source_dir,
+        args.output_dir,
+        output_format=args.format,
+        quality=args.quality,
+        resize=args.resize,
+        maintain_aspect=not args.exact,
+        suffix=args.suffix,
+        max_bytes=int(args.max_kb * 1024) if args.max_kb else None,
+        effort=args.effort,
+        workers=args.workers,
+        manifest_path=args.manifest,
+        interval=args.interval,
+        on_event=report
+    )
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_gui():
+    # Tk and the GUI are only imported here, so the command line modes start without them
+    import customtkinter as ctk
+    from cache import ConversionCache
+    from converter import ImageConverter
+    from gui import ImageConverterGUI
 
-def main():
     # Appearance configuration
     ctk.set_appearance_mode("Dark")
     ctk.set_default_color_theme("blue")
-    
+
     # Create main window
     root = ctk.CTk()
     root.title("Image Converter Pro")
     root.geometry("1000x750")
     root.minsize(900, 650)
-    
-    # Initialize application
-    converter = ImageConverter()
+
+    # Initialize application, caching results so toggling settings back is instant
+    converter = ImageConverter(cache=ConversionCache(max_bytes=128 * 1024 * 1024))
     app = ImageConverterGUI(root, converter)
-    
+
     # Center window
     root.eval('tk::PlaceWindow . center')
-    
+
     # Start main loop
     root.mainloop()
 
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "watch":
+        return run_watch(args)
+    if args.command == "serve":
+        from server import serve
+        return serve(args.host, args.port, args.workers, args.max_queue, args.verbose)
+
+    run_gui()
+    return 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import math
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def measure(metrics, name):
+    """Record a block as a stage of metrics, or do nothing when metrics is None"""
+    if metrics is None:
+        return nullcontext({})
+    return metrics.stage(name)
+
+
+class ConversionMetrics:
+    """Wall time, CPU time and allocations for each stage of one converter call
+
+    Stages are recorded in the order they finish. CPU time is measured for
+    the thread running the stage. allocated_bytes is the growth of the
+    Python heap and is only available while tracemalloc is tracing;
+    image_bytes is the pixel buffer size of the image a stage produced,
+    which covers Pillow's own allocations.
+    """
+
+    def __init__(self, call):
+        self.call = call
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, results carry metrics between processes
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Record the block as a stage; set record['image'] to count its output"""
+        record = {'name': name, 'image': None}
+        tracing = tracemalloc.is_tracing()
+        allocated_before = tracemalloc.get_traced_memory()[0] if tracing else None
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield record
+        finally:
+            image = record.pop('image')
+            record['wall'] = time.perf_counter() - wall_started
+            record['cpu'] = time.thread_time() - cpu_started
+            record['allocated_bytes'] = (tracemalloc.get_traced_memory()[0] - allocated_before
+                                         if tracing else None)
+            record['image_bytes'] = (image.width * image.height * len(image.getbands())
+                                     if image is not None else None)
+            with self.lock:
+                self.stages.append(record)
+
+    def total(self, key='wall'):
+        """Sum of one measurement over all stages"""
+        return sum(record[key] for record in self.stages)
+
+    def as_dict(self):
+        """Plain data for reporting or sending between processes"""
+        return {'call': self.call, 'stages': [dict(record) for record in self.stages]}
+
+    def format(self):
+        """One line per stage, for display"""
+        lines = []
+        for record in self.stages:
+            line = f"{record['name']}: {record['wall'] * 1000:.1f} ms (cpu {record['cpu'] * 1000:.1f} ms)"
+            if record['image_bytes']:
+                line += f", {record['image_bytes'] / 1048576:.1f} MB image"
+            if record['allocated_bytes']:
+                line += f", {record['allocated_bytes'] / 1048576:.1f} MB allocated"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class MetricsAggregator:
+    """Collect stage records from many calls and summarize them as percentiles"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, metrics):
+        """Add a ConversionMetrics or its as_dict() form"""
+        if isinstance(metrics, ConversionMetrics):
+            metrics = metrics.as_dict()
+        for record in metrics['stages']:
+            self.samples.setdefault(record['name'], []).append(record)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Per stage: sample count and wall/cpu time percentiles in seconds"""
+        result = {}
+        for name, records in self.samples.items():
+            stage = {'count': len(records)}
+            for key in ['wall', 'cpu']:
+                values = sorted(record[key] for record in records)
+                for percent in percentiles:
+                    stage[f"{key}_p{percent}"] = percentile(values, percent)
+            result[name] = stage
+        return result
+
+    def format(self, percentiles=(50, 90, 99)):
+        """Table of wall time percentiles per stage, for display"""
+        header = f"{'stage':<20} {'count':>6} " + " ".join(f"{'p' + str(p):>9}" for p in percentiles)
+        lines = [header]
+        for name, stage in self.summary(percentiles).items():
+            values = " ".join(f"{stage[f'wall_p{p}'] * 1000:>7.1f}ms" for p in percentiles)
+            lines.append(f"{name:<20} {stage['count']:>6} {values}")
+        return "\n".join(lines)
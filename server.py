@@ -0,0 +1,309 @@
+"""Local HTTP conversion service
+
+Keeps a pool of warm worker processes so each request skips interpreter
+startup and Pillow plugin loading:
+
+    python main.py serve --port 8765
+    curl --data-binary @photo.jpg -o photo.webp \
+        "http://127.0.0.1:8765/convert?format=webp&quality=80&width=1280"
+    curl http://127.0.0.1:8765/stats
+
+POST /convert takes the image as the raw request body. Query parameters:
+format (default JPEG), quality (default 85), width and/or height (fit
+inside, never enlarged), exact=1 to force that size, max_kb to search
+for the highest quality that fits, ssim to pick the lowest quality
+reaching that SSIM and effort (fast, balanced or max). The response is
+the encoded image with its dimensions and quality in X-Image-* headers.
+When every worker is busy and the queue is full the server answers 429
+instead of queueing more.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from core import DEFAULT_EFFORT, EFFORTS, INPUT_FORMATS, ConversionJob, load_plugins, normalize_format, run_job
+from metrics import percentile
+
+OUTPUT_FORMATS = ['JPEG', 'PNG', 'WEBP', 'BMP']
+MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'BMP': 'image/bmp'}
+
+# Latencies kept for the stats percentiles
+LATENCY_WINDOW = 1000
+
+
+def _warm_worker():
+    """Load the Pillow plugins in use and run the encoders once before the first request"""
+    load_plugins(INPUT_FORMATS)
+    image = Image.new('RGB', (16, 16))
+    for output_format in OUTPUT_FORMATS:
+        image.save(BytesIO(), format=output_format)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """HTTP server handing conversions to a process pool with a bounded queue
+
+    At most workers + max_queue conversions are accepted at once; requests
+    beyond that get 429 so clients back off instead of piling up memory.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8765), workers=None, max_queue=None,
+                 max_upload=64 * 1024 * 1024, timeout=60, verbose=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 2 if max_queue is None else max_queue
+        self.max_upload = max_upload
+        self.request_timeout = timeout
+        self.verbose = verbose
+        self.pool = self.start_pool()
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.started = time.time()
+        self.counters = {'requests': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.conversion_times = deque(maxlen=LATENCY_WINDOW)
+
+        super().__init__(address, ConversionHandler)
+
+    def start_pool(self):
+        """Create the worker pool and start every worker before requests arrive"""
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        for future in [pool.submit(_warm_worker) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def replace_pool(self, broken):
+        """Swap in a new pool after a worker died, unless another request already did"""
+        with self.lock:
+            if self.pool is not broken:
+                return
+            self.pool = self.start_pool()
+        broken.shutdown(wait=False)
+
+    def acquire_slot(self):
+        """Reserve room for one conversion, False when the queue is full"""
+        with self.lock:
+            self.counters['requests'] += 1
+            if self.in_flight >= self.workers + self.max_queue:
+                self.counters['rejected'] += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release_slot(self, success, latency, result=None, bytes_in=0):
+        """Free a slot and record the outcome of its conversion"""
+        with self.lock:
+            self.in_flight -= 1
+            self.counters['completed' if success else 'failed'] += 1
+            self.latencies.append(latency)
+            self.bytes_in += bytes_in
+            if result is not None and result.success:
+                self.bytes_out += len(result.data)
+                self.conversion_times.append(result.metrics.total())
+
+    def stats(self):
+        """Counters, queue state, throughput and latency percentiles"""
+        with self.lock:
+            uptime = time.time() - self.started
+            latencies = sorted(self.latencies)
+            conversion_times = sorted(self.conversion_times)
+            stats = dict(self.counters)
+            stats.update({
+                'uptime': uptime,
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - self.workers),
+                'capacity': self.workers + self.max_queue,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'images_per_sec': self.counters['completed'] / uptime if uptime > 0 else 0.0,
+            })
+
+        for percent in (50, 90, 99):
+            stats[f"latency_p{percent}"] = percentile(latencies, percent)
+            stats[f"conversion_p{percent}"] = percentile(conversion_times, percent)
+        return stats
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server_version = "ImageConverter/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_text(self, status, text, headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            body = json.dumps(self.server.stats(), indent=2).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == "/health":
+            self.send_text(200, "ok")
+        else:
+            self.send_text(404, "Not found")
+
+    def parse_job(self, query):
+        """Build a ConversionJob from the query string, raises ValueError if invalid
+
+        The source is left as None until the request body has been read.
+        """
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        output_format = normalize_format(params.get('format', 'JPEG'))
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unsupported format '{output_format}', expected one of {', '.join(OUTPUT_FORMATS)}")
+
+        quality = int(params.get('quality', 85))
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+
+        width = int(params['width']) if params.get('width') else None
+        height = int(params['height']) if params.get('height') else None
+        if (width is not None and width < 1) or (height is not None and height < 1):
+            raise ValueError("width and height must be positive")
+        exact = params.get('exact', '0').lower() in ['1', 'true', 'yes']
+
+        resize = None
+        if width or height:
+            if exact and not (width and height):
+                raise ValueError("exact needs both width and height")
+            # A missing side doesn't constrain the fit
+            resize = (width or 1 << 30, height or 1 << 30)
+
+        max_bytes = int(float(params['max_kb']) * 1024) if params.get('max_kb') else None
+
+        target_ssim = float(params['ssim']) if params.get('ssim') else None
+        if target_ssim is not None and not 0 < target_ssim < 1:
+            raise ValueError("ssim must be between 0 and 1")
+        if max_bytes and target_ssim:
+            raise ValueError("max_kb and ssim can't be combined")
+
+        effort = params.get('effort', DEFAULT_EFFORT).lower()
+        if effort not in EFFORTS:
+            raise ValueError(f"unknown effort '{effort}', expected one of {', '.join(EFFORTS)}")
+        return ConversionJob(None, output_format, quality, resize, not exact, max_bytes, effort, target_ssim)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            self.send_text(404, "Not found")
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self.send_text(400, "Send the image as the request body")
+            return
+        if length > self.server.max_upload:
+            self.send_text(413, f"Upload larger than {self.server.max_upload // 1048576} MB")
+            return
+
+        try:
+            job = self.parse_job(url.query)
+        except ValueError as e:
+            self.send_text(400, f"Invalid parameters: {str(e)}")
+            return
+
+        # Reject before reading the body, so a full queue doesn't cost full uploads
+        if not self.server.acquire_slot():
+            self.close_connection = True
+            self.send_text(429, "Too many conversions queued, retry later", {"Retry-After": "1"})
+            return
+
+        started = time.perf_counter()
+        try:
+            data = self.rfile.read(length)
+        except OSError:
+            self.server.release_slot(False, time.perf_counter() - started)
+            raise
+        if len(data) < length:
+            self.server.release_slot(False, time.perf_counter() - started)
+            return
+
+        def finished(future):
+            # Runs when the worker is done, even after the request timed out, so the slot
+            # stays taken for as long as the conversion occupies the pool
+            result = None if future.cancelled() or future.exception() else future.result()
+            success = result is not None and result.success
+            self.server.release_slot(success, time.perf_counter() - started, result, length)
+
+        result = None
+        pool = self.server.pool
+        try:
+            future = pool.submit(run_job, job._replace(source=data))
+        except Exception as e:
+            self.server.release_slot(False, time.perf_counter() - started)
+            if isinstance(e, BrokenProcessPool):
+                self.server.replace_pool(pool)
+            self.send_text(500, f"Worker error: {str(e)}")
+            return
+        future.add_done_callback(finished)
+
+        try:
+            result = future.result(timeout=self.server.request_timeout)
+        except TimeoutError:
+            self.send_text(504, "Conversion timed out")
+        except BrokenProcessPool as e:
+            # A worker was killed (e.g. out of memory), later requests get a fresh pool
+            self.server.replace_pool(pool)
+            self.send_text(500, f"Worker error: {str(e)}")
+        except Exception as e:
+            self.send_text(500, f"Worker error: {str(e)}")
+
+        if result is None:
+            return
+        if not result.success:
+            self.send_text(422, result.message)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", MIME_TYPES[result.format])
+        self.send_header("Content-Length", str(len(result.data)))
+        self.send_header("X-Image-Width", str(result.size[0]))
+        self.send_header("X-Image-Height", str(result.size[1]))
+        self.send_header("X-Image-Quality", str(result.quality))
+        self.send_header("X-Conversion-Ms", f"{result.metrics.total() * 1000:.1f}")
+        self.end_headers()
+        self.wfile.write(result.data)
+
+
+def serve(host="127.0.0.1", port=8765, workers=None, max_queue=None, verbose=False):
+    """Run the service until interrupted"""
+    server = ConversionServer((host, port), workers=workers, max_queue=max_queue, verbose=verbose)
+    print(f"Serving on http://{host}:{server.server_address[1]} with {server.workers} workers "
+          f"(queue {server.max_queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,281 @@
+import math
+import os
+import struct
+import threading
+import zlib
+
+from PIL import Image
+
+from core import guess_format, load_plugins, normalize_format, open_image, output_size, unlink_shared
+
+# Formats whose output can be written band by band
+STREAMABLE_OUTPUTS = ['PNG', 'BMP']
+
+# LANCZOS looks this many source pixels (times the downscale factor) either side
+LANCZOS_SUPPORT = 3
+
+# Copies of a band alive at once: decoded input, mode-converted input, resized output
+BAND_COPIES = 3
+
+_bomb_check_lock = threading.Lock()
+
+
+def _open_unchecked(path):
+    """Open an image without Pillow's decompression bomb limit
+
+    Streaming never holds the full image in memory, so the pixel limit that
+    protects whole-image decodes doesn't apply here.
+    """
+    with _bomb_check_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return open_image(path, [guess_format(path)])
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _output_mode(mode, output_format):
+    """Pick the mode the output is written in"""
+    if mode in ['1', 'L', 'I', 'I;16', 'I;16B', 'I;16L', 'F']:
+        return 'L'
+    if output_format in ['JPEG', 'BMP']:
+        return 'RGB'
+    if mode == 'LA' and output_format == 'PNG':
+        return 'LA'
+    # Palette images may carry transparency
+    return 'RGBA' if mode in ['P', 'PA'] or 'A' in mode else 'RGB'
+
+
+class StripReader:
+    """Decode horizontal bands of an uncompressed image straight from disk
+
+    Works for files whose pixel data Pillow describes as raw tiles, which
+    covers BMP and uncompressed (striped or tiled) TIFF. Each band reopens
+    the file and decodes only the rows it needs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with _open_unchecked(path) as image:
+            self.format = image.format
+            self.mode = image.mode
+            self.size = image.size
+            self.tiles = list(image.tile)
+            self.row_bits = self._tiff_bits(image) if image.format == 'TIFF' else None
+            # Pillow rotates EXIF-oriented TIFFs after loading, which bands can't follow
+            oriented = image.format == 'TIFF' and image.tag_v2.get(274, 1) != 1
+        self.bandable = (bool(self.tiles) and not oriented
+                         and all(self._row_stride(tile) for tile in self.tiles))
+
+    def _tiff_bits(self, image):
+        """Bits per pixel of one stored row element, from the TIFF tags"""
+        bits_per_sample = image.tag_v2.get(258, (1,))
+        if isinstance(bits_per_sample, int):
+            bits_per_sample = (bits_per_sample,)
+        samples = image.tag_v2.get(277, 1)
+        # Planar configuration 2 stores each sample in its own plane
+        if image.tag_v2.get(284, 1) == 2:
+            return bits_per_sample[0]
+        if len(bits_per_sample) == 1:
+            return bits_per_sample[0] * samples
+        return sum(bits_per_sample)
+
+    def _row_stride(self, tile):
+        """Bytes per stored row of a raw tile, or None if it isn't raw"""
+        decoder_name, extents, offset, args = tile
+        if decoder_name != 'raw':
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        if len(args) > 1 and args[1]:
+            return abs(args[1])
+        if self.row_bits:
+            return (extents[2] - extents[0]) * self.row_bits // 8 + bool((extents[2] - extents[0]) * self.row_bits % 8)
+        return None
+
+    def read(self, top, bottom):
+        """Decode rows top..bottom (exclusive) as an image of their own"""
+        band_tiles = []
+        for tile in self.tiles:
+            decoder_name, (x0, y0, x1, y1), offset, args = tile
+            start, end = max(top, y0), min(bottom, y1)
+            if start >= end:
+                continue
+
+            if isinstance(args, str):
+                args = (args, 0, 1)
+            stride = self._row_stride(tile)
+            orientation = args[2] if len(args) > 2 else 1
+
+            # Bottom-up tiles store their last row first
+            if orientation < 0:
+                band_offset = offset + (y1 - end) * stride
+            else:
+                band_offset = offset + (start - y0) * stride
+            band_tiles.append((decoder_name, (x0, start - top, x1, end - top), band_offset,
+                               (args[0], stride, orientation) + tuple(args[3:])))
+
+        band = _open_unchecked(self.path)
+        band._size = (self.size[0], bottom - top)
+        # TIFF allocates its pixel buffer from the stored dimensions
+        band._tile_size = band._size
+        band.tile = band_tiles
+        # Decode into memory owned by the band instead of memory-mapping the file
+        band.filename = ""
+        band.load()
+        return band
+
+
+class PngStreamWriter:
+    """Write a PNG incrementally, one band of rows at a time"""
+
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, path, size, mode, compress_level=6):
+        self.file = open(path, 'wb')
+        self.mode = mode
+        self.row_bytes = size[0] * len(mode)
+        self.compressor = zlib.compressobj(compress_level)
+
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data)
+        self.file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, band):
+        """Append the rows of band"""
+        raw = band.tobytes()
+        # Every row starts with its filter type, 0 (None)
+        rows = b''.join(b'\x00' + raw[i:i + self.row_bytes] for i in range(0, len(raw), self.row_bytes))
+        compressed = self.compressor.compress(rows)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+
+class BmpStreamWriter:
+    """Write a top-down BMP incrementally, one band of rows at a time"""
+
+    def __init__(self, path, size, mode):
+        self.file = open(path, 'wb')
+        self.mode = mode
+        bits = {'L': 8, 'RGB': 24}[mode]
+        self.rawmode = {'L': 'L', 'RGB': 'BGR'}[mode]
+        self.row_bytes = size[0] * bits // 8
+        self.padding = b'\x00' * (-self.row_bytes % 4)
+
+        palette = b''.join(bytes((i, i, i, 0)) for i in range(256)) if mode == 'L' else b''
+        header_size = 14 + 40 + len(palette)
+        image_size = (self.row_bytes + len(self.padding)) * size[1]
+
+        self.file.write(b'BM' + struct.pack('<IHHI', header_size + image_size, 0, 0, header_size))
+        # A negative height marks rows as stored top to bottom
+        self.file.write(struct.pack('<IiiHHIIiiII', 40, size[0], -size[1], 1, bits, 0,
+                                    image_size, 2835, 2835, len(palette) // 4, 0))
+        self.file.write(palette)
+
+    def write(self, band):
+        """Append the rows of band"""
+        raw = band.tobytes('raw', self.rawmode)
+        if self.padding:
+            raw = b''.join(raw[i:i + self.row_bytes] + self.padding for i in range(0, len(raw), self.row_bytes))
+        self.file.write(raw)
+
+    def close(self):
+        self.file.close()
+
+
+def stream_convert(source, destination, output_format, quality=85, resize=None,
+                   maintain_aspect=True, max_memory=256 * 1024 * 1024, save_kwargs=None):
+    """Convert a large image band by band with bounded memory
+
+    Bands of the source are decoded, mode-converted and resized on their own,
+    with enough overlap that LANCZOS sees the same neighbours as a
+    whole-image resize. PNG and BMP output is written incrementally. JPEG
+    and WEBP encoders need the whole picture, so the (resized) output is
+    assembled in memory and must fit in max_memory itself.
+    Returns (success, message) like ImageConverter.
+    """
+    try:
+        output_format = normalize_format(output_format)
+        reader = StripReader(source)
+        if not reader.bandable:
+            return False, (f"Streaming error: {reader.format} data in {os.path.basename(source)} "
+                           f"is compressed and can't be decoded in bands")
+        unlink_shared(destination)
+
+        width, height = reader.size
+        out_size = tuple(output_size(reader.size, resize, maintain_aspect))
+        out_width, out_height = out_size
+        mode = _output_mode(reader.mode, output_format)
+
+        assembled = None
+        if output_format in STREAMABLE_OUTPUTS:
+            writer_class = PngStreamWriter if output_format == 'PNG' else BmpStreamWriter
+        else:
+            out_bytes = out_width * out_height * len(mode)
+            if out_bytes > max_memory // 2:
+                return False, (f"Streaming error: a {out_width}x{out_height} {output_format} needs "
+                               f"{out_bytes / 1048576:.0f} MB in memory, over the "
+                               f"{max_memory / 1048576:.0f} MB budget - use PNG/BMP or a smaller size")
+            max_memory -= out_bytes
+            assembled = Image.new(mode, out_size)
+
+        # Rows of output per band so the band's input fits in the budget
+        scale = height / out_height
+        margin = math.ceil(LANCZOS_SUPPORT * max(scale, 1)) if out_size != reader.size else 0
+        input_row_bytes = width * max(len(reader.mode), len(mode), 4)
+        input_rows = max(1, max_memory // (BAND_COPIES * input_row_bytes) - 2 * margin)
+        band_rows = max(1, min(int(input_rows / scale), max_memory // (BAND_COPIES * out_width * 4)))
+
+        if save_kwargs is None:
+            save_kwargs = {'quality': quality}
+        writer = None
+        if assembled is None and output_format == 'PNG':
+            # Same zlib level Pillow's PNG encoder would use for these settings
+            compress_level = 9 if save_kwargs.get('optimize') else save_kwargs.get('compress_level', 6)
+            writer = writer_class(destination, out_size, mode, compress_level)
+        elif assembled is None:
+            writer = writer_class(destination, out_size, mode)
+        try:
+            for out_top in range(0, out_height, band_rows):
+                out_bottom = min(out_height, out_top + band_rows)
+
+                # Source rows covering this band, plus filter overlap
+                source_top = out_top * height / out_height
+                source_bottom = out_bottom * height / out_height
+                read_top = max(0, int(source_top) - margin)
+                read_bottom = min(height, math.ceil(source_bottom) + margin)
+
+                band = reader.read(read_top, read_bottom)
+                if band.mode != mode:
+                    band = band.convert(mode)
+                if out_size != reader.size:
+                    band = band.resize((out_width, out_bottom - out_top), Image.Resampling.LANCZOS,
+                                       box=(0, source_top - read_top, width, source_bottom - read_top))
+
+                if writer:
+                    writer.write(band)
+                else:
+                    assembled.paste(band, (0, out_top))
+                del band
+        finally:
+            if writer:
+                writer.close()
+
+        if assembled is not None:
+            # Encode straight to the destination file, not an in-memory buffer
+            load_plugins([output_format])
+            assembled.save(destination, format=output_format, **save_kwargs)
+
+        return True, f"Image saved to: {destination}"
+
+    except Exception as e:
+        return False, f"Streaming error: {str(e)}"
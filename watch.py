@@ -0,0 +1,177 @@
+import json
+import os
+import time
+
+from batch import BatchConverter, find_images
+from cache import ConversionCache
+from core import DEFAULT_EFFORT
+
+MANIFEST_NAME = ".imageconverter-manifest.json"
+MANIFEST_VERSION = 1
+
+
+class WatchFolder:
+    """Keep an output directory in sync with a watched source directory
+
+    The directory is polled every interval seconds. A JSON manifest records
+    for each source its content hash, the settings it was converted with
+    and the output written, so only new or modified files are converted
+    and outputs of deleted sources are removed. The manifest is saved while
+    converting, after each output is written, so a restart resumes where
+    the last run stopped.
+    """
+
+    def __init__(self, source_dir, output_dir, output_format="JPEG", quality=85, resize=None,
+                 maintain_aspect=True, suffix="", max_bytes=None, effort=DEFAULT_EFFORT, workers=None,
+                 manifest_path=None, interval=2.0, settle=1.0, on_event=None):
+        self.source_dir = os.path.abspath(source_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.batch = BatchConverter(self.output_dir, output_format, quality, resize, maintain_aspect,
+                                    workers=workers, suffix=suffix, max_bytes=max_bytes, effort=effort)
+        self.settings = {
+            'format': self.batch.output_format,
+            'quality': quality,
+            'resize': list(resize) if resize else None,
+            'maintain_aspect': maintain_aspect,
+            'suffix': suffix,
+            'max_bytes': max_bytes,
+            'effort': effort,
+        }
+        self.manifest_path = manifest_path or os.path.join(self.output_dir, MANIFEST_NAME)
+        self.interval = interval
+        # Files modified this recently may still be being written
+        self.settle = settle
+        self.on_event = on_event
+        self.entries = {}
+        self.last_saved = 0.0
+        self.load_manifest()
+
+    def event(self, kind, source, message=""):
+        if self.on_event:
+            self.on_event(kind, source, message)
+
+    def load_manifest(self):
+        """Read the manifest left by an earlier run, starting empty if there is none"""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') == MANIFEST_VERSION:
+            self.entries = manifest.get('files', {})
+
+    def save_manifest(self):
+        """Write the manifest atomically so a crash never leaves it half written"""
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
+        self.last_saved = time.monotonic()
+
+    def remove_output(self, entry):
+        """Delete an output written by an earlier conversion"""
+        if not entry.get('output'):
+            return
+        # Sources differing only in extension can share an output name
+        if any(other.get('output') == entry['output'] for other in self.entries.values()):
+            return
+        try:
+            os.remove(os.path.join(self.output_dir, entry['output']))
+        except OSError:
+            pass
+
+    def is_current(self, entry, stat, full_path):
+        """Check whether an entry still describes the source, hashing only if its stat changed"""
+        if entry is None or entry['settings'] != self.settings:
+            return False
+        if entry.get('output') and not os.path.exists(os.path.join(self.output_dir, entry['output'])):
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return True
+
+        # Touched or copied over with the same contents
+        if ConversionCache.source_key(full_path, content_hash=True)[1] != entry['sha256']:
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        return True
+
+    def scan(self):
+        """Bring the output directory up to date once, returning the batch summary or None"""
+        now = time.time()
+        found = {}
+        for full_path, relative in find_images([self.source_dir], self.batch.supported_formats):
+            # Outputs written inside the watched directory are not sources
+            if os.path.abspath(full_path).startswith(self.output_dir + os.sep):
+                continue
+            found[relative] = full_path
+
+        # Sources that disappeared take their outputs with them
+        removed = [relative for relative in self.entries if relative not in found]
+        for relative in removed:
+            self.remove_output(self.entries.pop(relative))
+            self.event("removed", relative)
+
+        tasks = []
+        pending = {}
+        for relative, full_path in sorted(found.items()):
+            try:
+                stat = os.stat(full_path)
+                if now - stat.st_mtime < self.settle:
+                    continue
+                if self.is_current(self.entries.get(relative), stat, full_path):
+                    continue
+                sha256 = ConversionCache.source_key(full_path, content_hash=True)[1]
+            except OSError:
+                continue
+
+            destination = self.batch.output_path(relative)
+            tasks.append((full_path, destination))
+            pending[full_path] = {
+                'relative': relative,
+                'sha256': sha256,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'output': os.path.relpath(destination, self.output_dir),
+            }
+
+        if not tasks:
+            if removed:
+                self.save_manifest()
+            return None
+
+        def record(result):
+            details = pending.pop(result['source'])
+            relative = details.pop('relative')
+            details['settings'] = self.settings
+            if result['success']:
+                self.event("converted", relative, result['message'])
+            else:
+                # Remember the failure so an unchanged broken file isn't retried every scan
+                details['output'] = None
+                details['error'] = result['message']
+                self.event("failed", relative, result['message'])
+
+            # A failed source no longer has an output, so its old one goes too
+            previous = self.entries.pop(relative, None)
+            if previous and previous.get('output') != details['output']:
+                self.remove_output(previous)
+            self.entries[relative] = details
+
+            if time.monotonic() - self.last_saved >= 1.0:
+                self.save_manifest()
+
+        try:
+            summary = self.batch.convert(tasks, on_result=record)
+        finally:
+            self.save_manifest()
+        return summary
+
+    def run(self, once=False):
+        """Scan until interrupted, or a single time with once"""
+        while True:
+            self.scan()
+            if once:
+                return
+            time.sleep(self.interval)
@@ -0,0 +1,108 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConversionWorker:
+    """Runs converter jobs on a background thread and hands results back to Tk
+
+    Jobs are grouped by key. Submitting a job supersedes any older job with
+    the same key: if the old one hasn't started yet it is skipped, and if it
+    is already running its result is dropped. Results are delivered on the
+    Tk thread by polling with root.after, since Tk isn't thread-safe.
+    """
+
+    def __init__(self, root, debounce_ms=120, poll_ms=30, on_busy_change=None):
+        self.root = root
+        self.debounce_ms = debounce_ms
+        self.poll_ms = poll_ms
+        self.on_busy_change = on_busy_change
+        # A single thread also serializes every access to the shared converter
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="converter")
+        self.results = queue.Queue()
+        self.generations = {}
+        self.debounced = {}
+        self.outstanding = 0
+        self.polling = False
+
+    def submit(self, key, job, callback, debounce=False, errback=None):
+        """Run job() in the background and call callback(result) on the Tk thread"""
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+
+        # Coalesce rapid events: only the last one inside the window is started
+        if key in self.debounced:
+            self.root.after_cancel(self.debounced.pop(key))
+        if debounce:
+            self.debounced[key] = self.root.after(
+                self.debounce_ms, lambda: self._start(key, generation, job, callback, errback))
+        else:
+            self._start(key, generation, job, callback, errback)
+
+    def cancel(self, key):
+        """Supersede every submitted job for key without starting a new one"""
+        self.generations[key] = self.generations.get(key, 0) + 1
+        if key in self.debounced:
+            self.root.after_cancel(self.debounced.pop(key))
+
+    def is_current(self, key, generation):
+        """Check whether no newer job was submitted for key"""
+        return self.generations.get(key) == generation
+
+    def _start(self, key, generation, job, callback, errback):
+        self.debounced.pop(key, None)
+        if not self.is_current(key, generation):
+            return
+
+        self._set_outstanding(self.outstanding + 1)
+        future = self.executor.submit(self._run, key, generation, job)
+        future.add_done_callback(lambda f: self.results.put((key, generation, callback, errback, f)))
+
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _run(self, key, generation, job):
+        # Skip jobs that went stale while waiting in the queue
+        if not self.is_current(key, generation):
+            return None
+        return job()
+
+    def _poll(self):
+        """Deliver finished results on the Tk thread"""
+        try:
+            while True:
+                try:
+                    key, generation, callback, errback, future = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self._set_outstanding(self.outstanding - 1)
+                if not self.is_current(key, generation):
+                    continue
+
+                error = future.exception()
+                if error is None:
+                    callback(future.result())
+                elif errback:
+                    errback(error)
+                else:
+                    raise error
+        finally:
+            # Keep polling even if a callback raised, so later results still arrive
+            if self.outstanding:
+                self.root.after(self.poll_ms, self._poll)
+            else:
+                self.polling = False
+
+    def _set_outstanding(self, count):
+        was_busy = self.outstanding > 0
+        self.outstanding = count
+        if self.on_busy_change and was_busy != (count > 0):
+            self.on_busy_change(count > 0)
+
+    def shutdown(self):
+        """Stop accepting jobs and drop anything still queued"""
+        for after_id in self.debounced.values():
+            self.root.after_cancel(after_id)
+        self.debounced.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)